@@ -1,26 +1,162 @@
 """Builder Base Class"""
+import hashlib
+import json
 import os
+import subprocess
+import sys
+import threading
+import traceback
+from collections import ChainMap
+from concurrent.futures import ThreadPoolExecutor
 from itertools import groupby
 
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, \
+    TemplateError
 
+from regolith import __version__
+from regolith.jobs import run_jobs
+from regolith.manifest import Manifest, decode_id, digest, encode_id, \
+    template_digest
 from regolith.sorters import doc_date_key, category_val, \
     level_val, date_key
 from regolith.tools import date_to_rfc822, rfc822now, gets
+from regolith.tracking import ALL, FILES, graph, record, track
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(__file__), 'templates')
+
+TEMPLATE_EXTENSIONS = ('html', 'tex', 'xml', 'txt', 'bib')
+"""The extensions of the files in template directories that are templates,
+rather than static files."""
+
+RC_UNDIGESTED = frozenset(['force', 'explain', 'nprocs', 'cache',
+                           'cache_size', 'json_backend', 'debug', 'cmd',
+                           'build_targets', 'digest_keys'])
+"""Run control keys that change how a build runs, but not what it makes."""
+
+BUFSIZE = 1 << 16
+"""The size of the buffer of the files that templates are rendered into."""
+
+
+def make_env(rc):
+    """Returns a Jinja environment that loads templates from the
+    ``templates`` directory, then from regolith's own templates. Unless
+    ``rc.cache`` is off, compiled templates are kept in
+    ``${builddir}/_jinja``, so that later runs need not compile them again.
+    """
+    bcc = None
+    if getattr(rc, 'cache', True):
+        cachedir = os.path.join(rc.builddir, '_jinja')
+        os.makedirs(cachedir, exist_ok=True)
+        bcc = FileSystemBytecodeCache(cachedir)
+    return Environment(loader=FileSystemLoader(['templates', TEMPLATES_DIR]),
+                       bytecode_cache=bcc)
+
+
+def precompile(env):
+    """Compiles every template that an environment can load, filling its
+    bytecode cache. Only files with the extensions in
+    ``TEMPLATE_EXTENSIONS`` are templates, so static files are left alone.
+    Templates that fail to compile are skipped here; their errors are raised
+    if they are rendered.
+    """
+    for name in env.list_templates(extensions=TEMPLATE_EXTENSIONS):
+        try:
+            env.get_template(name)
+        except TemplateError:
+            pass
+
+
+def rc_digest(rc, keys=None):
+    """Returns the digest of the regolith version and of the values of the
+    run control that templates may read. Values that cannot be written as
+    JSON, such as the client, and those in ``RC_UNDIGESTED`` are left out.
+
+    Parameters
+    ----------
+    rc : RunControl or SimpleNamespace
+        The run control.
+    keys : iterable of str, optional
+        The keys to digest, defaults to ``rc.digest_keys`` if it is set,
+        which ``regolith.main`` sets to the keys of the defaults and of
+        regolithrc.json, rather than of the command line, or else to all of
+        the keys of rc.
+    """
+    if keys is None:
+        keys = getattr(rc, 'digest_keys', None)
+    if keys is None:
+        # run controls iterate over their keys, namespaces do not
+        keys = list(rc) if hasattr(rc, '__iter__') else list(vars(rc))
+    fields = {}
+    for key in keys:
+        if key in RC_UNDIGESTED or not hasattr(rc, key):
+            continue
+        value = getattr(rc, key)
+        try:
+            json.dumps(value)
+        except (TypeError, ValueError):
+            continue
+        fields[key] = value
+    return digest({'regolith': __version__, 'rc': fields})
+
+
+def write_stream(chunks, filename, bufsize=BUFSIZE):
+    """Writes an iterable of strings to a file through a buffer. The strings
+    are written to a temporary file that then replaces filename, so that a
+    partially written file is never seen, for example by a deploy.
+    """
+    dirname, basename = os.path.split(filename)
+    tmp = os.path.join(dirname, '.' + basename + '.tmp')
+    try:
+        with open(tmp, 'wt', buffering=bufsize) as f:
+            f.writelines(chunks)
+        os.replace(tmp, filename)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
 
 
 class BuilderBase(object):
-    """Base class for builders"""
+    """Base class for builders
+
+    Rendered files are only written again when their inputs changed since
+    the last build, see ``regolith.manifest``, unless ``rc.force`` is set.
+    The inputs of a file are its template, the templates that it includes,
+    the keyword arguments that it is rendered with, the run control and
+    regolith version, see ``rc_digest()``, the documents and collections
+    that rendering it read, see ``regolith.tracking``, and the files of the
+    build that it includes, see ``add_file_inputs()``. With
+    ``rc.explain`` set, the reason for rendering each file is printed.
+
+    Builders use the Jinja environment in ``rc.jinja_env`` if there is one,
+    so that builders of the same run share their compiled templates.
+    """
+    needed_colls = ()
+    derived_exts = ()
+    """Extensions of the files that are made from each rendered file, such
+    as the PDF of a LaTeX file, which are removed along with it when it is
+    stale.
+    """
+
     def __init__(self, rc):
         self.rc = rc
         self.bldir = os.path.join(rc.builddir, self.btype)
-        self.env = Environment(loader=FileSystemLoader([
-            'templates',
-            os.path.join(os.path.dirname(__file__), 'templates'),
-        ]))
+        self.env = getattr(rc, 'jinja_env', None) or make_env(rc)
         self.gtx = {}
         self.construct_global_ctx()
         self.cmds = []
+        self.failed = set()
+        self.manifest = Manifest(rc.builddir)
+        self.force = getattr(rc, 'force', False)
+        self.rendered = set()
+        self.visited = set()
+        self._template_digests = {}
+        self._read_digests = {}
+        self._templates = {}
+        self._rc_digest = None
+        self._dir_contexts = {}
+        self._file_inputs = {}
+        self._lock = threading.Lock()
 
     def construct_global_ctx(self):
         """Constructs the global context"""
@@ -50,23 +186,259 @@ class BuilderBase(object):
             Resulting file name
         kwargs : dict
             Additional kwargs to the renderer
+
+        Returns
+        -------
+        rendered : bool
+            False if the file was up to date, so was not rendered
+        """
+        return len(self.render_many(tname, [(fname, kwargs)])) > 0
+
+    def render_many(self, tname, items):
+        """Renders a template into many files, such as a page for each
+        document of a collection. The global context is set up once and
+        shared by all of the files, rather than copied for each of them.
+
+        Parameters
+        ----------
+        tname : str
+            Template name
+        items : iterable of (str, dict) pairs
+            The resulting file names and the kwargs to render each with,
+            which are laid over the global context
+
+        Returns
+        -------
+        rendered : list of str
+            The files that were rendered, rather than up to date
+        """
+        template = base = None
+        rendered = []
+        for fname, kwargs in items:
+            self.visited.add(fname)
+            inputs = self.inputs_digest(tname, kwargs)
+            reason = self.why_render(fname, inputs)
+            if getattr(self.rc, 'explain', False):
+                print('{0}/{1}: {2}'.format(self.btype, fname,
+                                            reason or 'up to date'))
+            if reason is None:
+                continue
+            if template is None:
+                template = self.get_template(tname)
+                base = dict(template.globals)
+                base['rc'] = self.rc
+                base.update(self.gtx)
+            ctx = template.new_context(ChainMap(
+                kwargs, base, self.dir_context(os.path.dirname(fname))),
+                shared=True)
+            with track() as reads:
+                for path in self._file_inputs.get(fname, ()):
+                    record(FILES, path)
+                write_stream(self.generate(template, ctx),
+                             os.path.join(self.bldir, fname))
+            reads = [[collname, encode_id(docid),
+                      self.read_digest(collname, docid)]
+                     for collname, ids in sorted(graph(reads).items())
+                     for docid in ids]
+            self.manifest.set(self.btype, fname, {'inputs': inputs,
+                                                  'reads': reads})
+            self.rendered.add(fname)
+            rendered.append(fname)
+        return rendered
+
+    def generate(self, template, ctx):
+        """Yields the rendered template piece by piece, rather than as one
+        string."""
+        try:
+            yield from template.root_render_func(ctx)
+        except Exception:
+            self.env.handle_exception()
+
+    def add_file_inputs(self, fname, paths):
+        """Records files of the build directory, such as plots, that a file
+        to be rendered includes, so that it is rendered again when their
+        contents change. This must be called before the file is rendered.
+        """
+        with self._lock:
+            self._file_inputs.setdefault(fname, set()).update(paths)
+
+    def get_template(self, tname):
+        """Returns a template, which is only looked up once per build."""
+        with self._lock:
+            if tname not in self._templates:
+                self._templates[tname] = self.env.get_template(tname)
+            return self._templates[tname]
+
+    def dir_context(self, dirname):
+        """Returns the relative paths from a directory of the build to the
+        static files and to the root of the build."""
+        with self._lock:
+            if dirname not in self._dir_contexts:
+                self._dir_contexts[dirname] = {
+                    'static': os.path.relpath('static', dirname),
+                    'root': os.path.relpath('/', dirname),
+                    }
+            return self._dir_contexts[dirname]
+
+    def inputs_digest(self, tname, kwargs):
+        """Returns the digest of the template and the keyword arguments of a
+        rendered file, and of the run control that it may read, or None if
+        the arguments cannot be digested, so that the file is always
+        rendered."""
+        with self._lock:
+            if tname not in self._template_digests:
+                self._template_digests[tname] = template_digest(self.env,
+                                                                tname)
+            if self._rc_digest is None:
+                self._rc_digest = rc_digest(self.rc)
+        try:
+            return digest([self._template_digests[tname], kwargs,
+                           self._rc_digest])
+        except TypeError:
+            # always outdated, rather than hashing what cannot be compared
+            return None
+
+    def read_digest(self, collname, docid):
+        """Returns the digest of the current state of a document, or of a
+        whole collection if docid is ``regolith.tracking.ALL``, or None if
+        it holds values that cannot be digested. For the ``FILES``
+        collection, the docid is the path of a file in the build directory,
+        whose contents are digested, or None if it is missing.
+        """
+        key = (collname, docid)
+        with self._lock:
+            if key not in self._read_digests and collname == FILES:
+                try:
+                    with open(os.path.join(self.bldir, docid), 'rb') as f:
+                        h = hashlib.sha1(f.read())
+                    self._read_digests[key] = h.hexdigest()
+                except OSError:
+                    self._read_digests[key] = None
+            elif key not in self._read_digests:
+                coll = self.rc.client.chained_db.get(collname, {})
+                if docid == ALL:
+                    obj = sorted(coll.values(),
+                                 key=lambda doc: str(doc.get('_id')))
+                else:
+                    obj = coll.get(docid, None)
+                try:
+                    self._read_digests[key] = digest(obj)
+                except TypeError:
+                    self._read_digests[key] = None
+            return self._read_digests[key]
+
+    def why_render(self, fname, inputs):
+        """Returns the reason that a file has to be rendered, or None if it
+        is up to date."""
+        entry = self.manifest.get(self.btype, fname)
+        if self.force:
+            return 'forced'
+        elif not isinstance(entry, dict):
+            return 'not built before'
+        elif not os.path.isfile(os.path.join(self.bldir, fname)):
+            return 'output is missing'
+        elif inputs is None:
+            return 'arguments cannot be digested'
+        elif entry.get('inputs') != inputs:
+            return 'template, arguments, or rc changed'
+        elif not isinstance(entry.get('reads'), list):
+            return 'not built before'
+        for collname, docid, value in entry['reads']:
+            docid = decode_id(docid)
+            current = self.read_digest(collname, docid)
+            if current is None or current != value:
+                if docid == ALL:
+                    return collname + ' changed'
+                return '{0}/{1} changed'.format(collname, docid)
+        return None
+
+    def outdated(self, fname, target):
+        """Tests if a target made from a rendered file, such as a PDF, has to
+        be made again, because the file was rendered or the target is missing.
         """
-        template = self.env.get_template(tname)
-        ctx = dict(self.gtx)
-        ctx.update(kwargs)
-        ctx['rc'] = ctx.get('rc', self.rc)
-        ctx['static'] = ctx.get('static',
-                                os.path.relpath('static',
-                                                os.path.dirname(fname)))
-        ctx['root'] = ctx.get('root',
-                              os.path.relpath('/', os.path.dirname(fname)))
-        result = template.render(ctx)
-        with open(os.path.join(self.bldir, fname), 'wt') as f:
-            f.write(result)
+        return fname in self.rendered or \
+            not os.path.isfile(os.path.join(self.bldir, target))
+
+    def remove_stale(self):
+        """Removes the files of earlier builds that were not rendered or up
+        to date in this one, for example because their documents were
+        deleted.
+        """
+        for fname in self.manifest.files(self.btype) - self.visited:
+            base = os.path.splitext(fname)[0]
+            for f in [fname] + [base + ext for ext in self.derived_exts]:
+                path = os.path.join(self.bldir, f)
+                if os.path.isfile(path):
+                    os.remove(path)
+            self.manifest.remove(self.btype, fname)
+
+    def for_each_person(self, func, people=None):
+        """Calls ``func(p)`` for each person, on up to ``rc.nprocs`` threads
+        at once. If func fails for a person, the error is reported and the
+        person's id is added to ``self.failed``, but the other people are
+        still built, and ``build()`` fails at the end.
+
+        Parameters
+        ----------
+        func : callable
+            Renders the output of a single person
+        people : iterable of dict, optional
+            The people to build for, defaults to everyone in the context
+        """
+        if people is None:
+            people = self.gtx['people']
+        people = [p for p in people if p['_id'] not in self.failed]
+        nprocs = getattr(self.rc, 'nprocs', 1)
+        if nprocs > 1 and len(people) > 1:
+            with ThreadPoolExecutor(max_workers=nprocs) as executor:
+                list(executor.map(self._call_for_person, [func] * len(people),
+                                  people))
+        else:
+            for p in people:
+                self._call_for_person(func, p)
+
+    def _call_for_person(self, func, p):
+        try:
+            func(p)
+        except Exception:
+            print('failed to build {0} for {1}:\n{2}'.format(
+                self.btype, p['_id'], traceback.format_exc()),
+                file=sys.stderr)
+            self.failed.add(p['_id'])
+
+    def run(self, cmd):
+        """Run command in build dir, capturing its output"""
+        return subprocess.run(cmd, cwd=self.bldir, check=True,
+                              stdin=subprocess.DEVNULL,
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT,
+                              universal_newlines=True, errors='replace')
+
+    def run_jobs(self, jobs):
+        """Runs jobs made of commands with ``run()``, on up to ``rc.nprocs``
+        threads at once, see ``regolith.jobs``. Jobs are named after the
+        LaTeX files that they compile, without the extension. The names of
+        the jobs that fail are added to ``self.failed``, so that ``build()``
+        fails at the end, and their LaTeX files will be rendered again next
+        time.
+        """
+        nprocs = getattr(self.rc, 'nprocs', 1)
+        failed = run_jobs(jobs, self.run, nprocs=nprocs)
+        for name in failed:
+            self.manifest.remove(self.btype, name + '.tex')
+        self.failed.update(failed)
 
     def build(self):
         """Build the thing that is being built, note this runs all commands
-        listed in ``self.cmds``"""
+        listed in ``self.cmds``. If anything in ``self.failed`` could not be
+        built, a RuntimeError is raised once everything else has been.
+        """
         os.makedirs(self.bldir, exist_ok=True)
         for cmd in self.cmds:
             getattr(self, cmd)()
+        if not self.failed:
+            self.remove_stale()
+        self.manifest.save()
+        if self.failed:
+            raise RuntimeError('could not build {0} for: {1}'.format(
+                self.btype, ', '.join(sorted(self.failed))))
@@ -0,0 +1,97 @@
+"""An on-disk cache of parsed collection files."""
+import hashlib
+import os
+import pickle
+
+DEFAULT_CACHE_SIZE = 256
+"""Default maximum size of the cache, in megabytes."""
+
+
+def hash_file(filename, blocksize=2**20):
+    """Returns the hex digest of the contents of a file."""
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class CollectionCache:
+    """A cache of parsed collections, stored as pickles in a directory.
+
+    Each entry is keyed on the path of the collection file and remembers the
+    file's size, mtime, and content hash. Entries whose size and mtime match
+    are hits without reading the file. When only the mtime has changed (eg.
+    after a checkout) the content hash decides. Once the cache grows past
+    maxsize megabytes, the least recently used entries are evicted. The
+    directory is only made when the first entry is stored.
+    """
+
+    def __init__(self, cachedir, maxsize=DEFAULT_CACHE_SIZE):
+        self.cachedir = cachedir
+        self.maxsize = maxsize * 2**20
+
+    def _entry(self, filename):
+        path = os.path.abspath(filename)
+        name = hashlib.sha1(path.encode('utf-8')).hexdigest() + '.pkl'
+        return path, os.path.join(self.cachedir, name)
+
+    def get(self, filename):
+        """Returns the cached documents for a file, or None on a miss."""
+        path, entry = self._entry(filename)
+        try:
+            with open(entry, 'rb') as f:
+                key = pickle.load(f)
+                st = os.stat(filename)
+                if key['path'] != path or key['size'] != st.st_size:
+                    return None
+                touched = key['mtime'] != st.st_mtime_ns
+                if touched and key['hash'] != hash_file(filename):
+                    return None
+                docs = pickle.load(f)
+        except (OSError, EOFError, KeyError, pickle.UnpicklingError):
+            return None
+        if touched:
+            # same content under a new mtime, store the new stat info
+            self.put(filename, docs, filehash=key['hash'])
+        else:
+            # mark the entry as recently used
+            os.utime(entry)
+        return docs
+
+    def put(self, filename, docs, filehash=None):
+        """Stores the parsed documents of a file in the cache."""
+        path, entry = self._entry(filename)
+        st = os.stat(filename)
+        key = {'path': path, 'size': st.st_size, 'mtime': st.st_mtime_ns,
+               'hash': hash_file(filename) if filehash is None else filehash}
+        os.makedirs(self.cachedir, exist_ok=True)
+        tmp = entry + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(key, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(docs, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, entry)
+        self.evict()
+
+    def evict(self):
+        """Removes least recently used entries until the cache fits."""
+        entries = []
+        for name in os.listdir(self.cachedir):
+            if not name.endswith('.pkl'):
+                continue
+            st = os.stat(os.path.join(self.cachedir, name))
+            entries.append((st.st_mtime, st.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.maxsize:
+                break
+            os.remove(os.path.join(self.cachedir, name))
+            total -= size
+
+    def clear(self):
+        """Removes all entries from the cache."""
+        if not os.path.isdir(self.cachedir):
+            return
+        for name in os.listdir(self.cachedir):
+            if name.endswith('.pkl'):
+                os.remove(os.path.join(self.cachedir, name))
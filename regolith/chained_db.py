@@ -41,3 +41,101 @@ class ChainDB(ChainMap):
             for mapping in reversed(self.maps):
                 if key in mapping:
                     mapping[key] = value
+
+
+class _MapList(list):
+    """The maps of a CachingChainDB, which clear its cache on any change."""
+
+    def __init__(self, maps, cache):
+        super().__init__(maps)
+        self._cache = cache
+
+    def _invalidating(name):
+        method = getattr(list, name)
+
+        def invalidate(self, *args):
+            self._cache.clear()
+            return method(self, *args)
+        invalidate.__name__ = name
+        return invalidate
+
+    append = _invalidating('append')
+    extend = _invalidating('extend')
+    insert = _invalidating('insert')
+    pop = _invalidating('pop')
+    remove = _invalidating('remove')
+    clear = _invalidating('clear')
+    reverse = _invalidating('reverse')
+    sort = _invalidating('sort')
+    __setitem__ = _invalidating('__setitem__')
+    __delitem__ = _invalidating('__delitem__')
+    __iadd__ = _invalidating('__iadd__')
+    __imul__ = _invalidating('__imul__')
+    del _invalidating
+
+
+class CachingChainDB(ChainDB):
+    """A ChainDB that remembers what each key looked up to, so that repeated
+    lookups such as ``z['a']['m']['y']`` do not walk the maps or allocate
+    new child views. Child views share the underlying mappings.
+
+    Cached values are dropped when their key is set or deleted through the
+    view, and the whole cache is dropped when ``.maps`` changes. Writes made
+    directly to the underlying mappings are not seen. Lists are never cached,
+    since callers get a new concatenated list that they may mutate.
+
+    This is an opt-in variant for code that does many deep lookups on the
+    same chain; nothing in regolith constructs one for you.
+    """
+
+    def __init__(self, *maps):
+        self._cache = {}
+        super().__init__(*maps)
+
+    @property
+    def maps(self):
+        return self._maps
+
+    @maps.setter
+    def maps(self, maps):
+        self._cache.clear()
+        self._maps = _MapList(maps, self._cache)
+
+    def __getitem__(self, key):
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        results = [mapping.get(key, None) for mapping in self.maps]
+        if all(isinstance(result, MutableMapping) for result in results):
+            res = type(self)(*results)
+        elif all(isinstance(result, list) for result in results):
+            return list(itertools.chain(*results))
+        else:
+            res = None
+            for result in reversed(results):
+                if result is not None:
+                    res = result
+                    break
+        self._cache[key] = res
+        return res
+
+    def __setitem__(self, key, value):
+        self._cache.pop(key, None)
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self._cache.pop(key, None)
+        super().__delitem__(key)
+
+    def pop(self, key, *args):
+        self._cache.pop(key, None)
+        return super().pop(key, *args)
+
+    def popitem(self):
+        self._cache.clear()
+        return super().popitem()
+
+    def clear(self):
+        self._cache.clear()
+        super().clear()
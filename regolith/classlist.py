@@ -104,9 +104,7 @@ LOADERS = {
 
 def add_students_to_db(students, rc):
     """Add new students to the student directory."""
-    for student in students:
-        rc.client.update_one(rc.db, 'students', {'_id': student['_id']},
-                             student, upsert=True)
+    rc.client.bulk_upsert(rc.db, 'students', students)
 
 
 def add_students_to_course(students, rc):
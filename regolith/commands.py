@@ -4,7 +4,8 @@ import re
 import json
 
 from regolith.tools import string_types
-from regolith.builder import builder
+from regolith.basebuilder import make_env, precompile
+from regolith.builder import builder, BUILDERS
 from regolith.emailer import emailer as email
 from regolith.deploy import deploy as dploy
 
@@ -45,17 +46,17 @@ def _ingest_citations(rc):
     parser.customization = customizations
     with open(rc.filename, 'r') as f:
         bibs = bibtexparser.load(f, parser=parser)
-    coll = rc.client[rc.db][rc.coll]
+    docs = []
     for bib in bibs.entries:
-        bibid = bib.pop('ID')
+        bib['_id'] = bib.pop('ID')
         bib['entrytype'] = bib.pop('ENTRYTYPE')
         if 'author' in bib:
             bib['author'] = [a.strip() for b in bib['author'] for a in
                              RE_AND.split(b)]
         if 'title' in bib:
             bib['title'] = RE_SPACE.sub(' ', bib['title'])
-        rc.client.update_one(rc.db, rc.coll, {'_id': bibid},
-                             bib, upsert=True)
+        docs.append(bib)
+    rc.client.bulk_upsert(rc.db, rc.coll, docs)
 
 
 def _determine_ingest_coll(rc):
@@ -101,6 +102,8 @@ def grade(rc):
 
 def build(rc):
     """Builds all of the build targets"""
+    rc.jinja_env = make_env(rc)
+    precompile(rc.jinja_env)
     for t in rc.build_targets:
         bldr = builder(t, rc)
         bldr.build()
@@ -120,6 +123,27 @@ def classlist(rc):
     register(rc)
 
 
+def needed_colls(rc):
+    """Returns the collections that a connected command is known to need,
+    or None if it may need any of them.
+    """
+    if rc.cmd == 'build':
+        colls = set()
+        for t in rc.build_targets:
+            colls.update(BUILDERS[t].needed_colls)
+        return colls
+    elif rc.cmd == 'email':
+        from regolith.emailer import EMAIL_COLLS
+        return set(EMAIL_COLLS.get(rc.email_target, ()))
+    elif rc.cmd == 'classlist':
+        return {'students', 'courses'}
+    elif rc.cmd == 'ingest':
+        return {rc.coll or _determine_ingest_coll(rc)}
+    elif rc.cmd == 'add':
+        return {rc.coll}
+    return None
+
+
 def json_to_yaml(rc):
     """Converts JSON to YAML"""
     from regolith import fsclient
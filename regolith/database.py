@@ -1,7 +1,8 @@
 """Helps manage mongodb setup and connections."""
 import os
 import subprocess
-from collections import ChainMap
+import threading
+from collections.abc import Mapping
 from contextlib import contextmanager
 from warnings import warn
 
@@ -11,6 +12,7 @@ except:
     hglib = None
 
 from regolith.tools import dbdirname
+from regolith.tracking import TrackedDocument, record
 from regolith.fsclient import FileSystemClient
 from regolith.mongoclient import MongoClient
 
@@ -70,6 +72,9 @@ def dump_git_database(db, client, rc):
     dbdir = dbdirname(db, rc)
     # dump all of the data
     to_add = client.dump_database(db)
+    if len(to_add) == 0:
+        # nothing changed, so there is nothing to commit or push
+        return
     # update the repo
     cmd = ['git', 'add'] + to_add
     subprocess.check_call(cmd, cwd=dbdir)
@@ -92,6 +97,8 @@ def dump_hg_database(db, client, rc):
     dbdir = dbdirname(db, rc)
     # dump all of the data
     to_add = client.dump_database(db)
+    if len(to_add) == 0:
+        return
     # update the repo
     hgclient = hglib.open(dbdir)
     if len(hgclient.status(include=to_add, modified=True,
@@ -113,26 +120,118 @@ def dump_database(db, client, rc):
         raise ValueError('Do not know how to dump this kind of database')
 
 
+class ChainedCollections(Mapping):
+    """Collections merged across databases, in order of precedence. Each
+    document is a ChainMap of the documents with the same id in every
+    database, which records when it is read, see ``regolith.tracking``. A
+    merged collection is only built when it is first accessed, so
+    collections that are never used are never parsed.
+
+    If materialize is True, documents are instead flattened into plain dicts
+    once, with the same precedence, so that lookups do not scan the maps.
+    Documents that are only in one database are not copied. Since plain
+    dicts cannot record their reads, accessing a materialized collection
+    records a read of the whole collection. Either way, the client calls
+    ``refresh()`` when it writes to a collection.
+    """
+
+    def __init__(self, client, dbnames, materialize=False):
+        self.client = client
+        self.dbnames = dbnames
+        self.materialize = materialize
+        self._colls = {}
+        self._lock = threading.RLock()
+
+    def _dbs(self):
+        dbs = self.client.dbs
+        return [dbs[name] for name in self.dbnames if name in dbs]
+
+    def _merge(self, collname, docid, docs):
+        if not self.materialize:
+            doc = TrackedDocument(*docs)
+            doc.collname = collname
+            doc.docid = docid
+            return doc
+        elif len(docs) == 1:
+            return docs[0]
+        merged = {}
+        for doc in reversed(docs):
+            merged.update(doc)
+        return merged
+
+    def __getitem__(self, collname):
+        if self.materialize:
+            record(collname)
+        if collname in self._colls:
+            return self._colls[collname]
+        with self._lock:
+            if collname in self._colls:
+                # merged by another thread in the meantime
+                return self._colls[collname]
+            colls = [db[collname] for db in self._dbs() if collname in db]
+            if len(colls) == 0:
+                raise KeyError(collname)
+            docs = {}
+            for coll in colls:
+                for k, v in coll.items():
+                    docs.setdefault(k, []).append(v)
+            merged = {k: self._merge(collname, k, v)
+                      for k, v in docs.items()}
+            self._colls[collname] = merged
+        return merged
+
+    def refresh(self, collname, ids=()):
+        """Merges the given documents of a collection again, after they were
+        written to. Without ids, the whole collection is merged again the
+        next time it is accessed.
+        """
+        with self._lock:
+            merged = self._colls.get(collname, None)
+            if merged is None:
+                return
+            elif not ids:
+                del self._colls[collname]
+                return
+            colls = [db[collname] for db in self._dbs() if collname in db]
+            for k in ids:
+                docs = [coll[k] for coll in colls if k in coll]
+                if docs:
+                    merged[k] = self._merge(collname, k, docs)
+                else:
+                    merged.pop(k, None)
+
+    def __contains__(self, collname):
+        return any(collname in db for db in self._dbs())
+
+    def __iter__(self):
+        seen = set()
+        for db in self._dbs():
+            for collname in db:
+                if collname not in seen:
+                    seen.add(collname)
+                    yield collname
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
 @contextmanager
-def connect(rc):
+def connect(rc, colls=None):
     """Context manager for ensuring that database is properly setup and torn
-    down"""
+    down. If colls is given, those collections are prefetched in the
+    background, since the command is known to need them.
+    """
     client = CLIENTS[rc.backend](rc)
     client.open()
-    chained_db = {}
     for db in rc.databases:
         if 'blacklist' not in db:
             db['blacklist'] = ['.travis.yml', '.travis.yaml']
         load_database(db, client, rc)
-        for base, coll in client.dbs[db['name']].items():
-            if base not in chained_db:
-                chained_db[base] = {}
-            for k, v in coll.items():
-                if k in chained_db[base]:
-                    chained_db[base][k].maps.append(v)
-                else:
-                    chained_db[base][k] = ChainMap(v)
-    client.chained_db = chained_db
+    client.chained_db = ChainedCollections(
+        client, [db['name'] for db in rc.databases],
+        materialize=getattr(rc, 'materialize', False))
+    if colls:
+        client.prefetch(colls)
     yield client
     for db in rc.databases:
         dump_database(db, client, rc)
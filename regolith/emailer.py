@@ -145,6 +145,14 @@ EMAIL_CONSTRUCTORS = {
     'list': list_email,
     }
 
+EMAIL_COLLS = {
+    'test': (),
+    'grade': ('students', 'courses'),
+    'grades': ('students', 'courses'),
+    'class': ('students', 'courses'),
+    'list': ('students', 'courses'),
+    }
+
 def emailer(rc):
     """Constructs and sends out emails"""
     constructor = EMAIL_CONSTRUCTORS[rc.email_target]
@@ -1,38 +1,68 @@
 """Contains a client database backed by the file system."""
-import json
 import os
 import sys
+import threading
 from collections import defaultdict
+from collections.abc import Hashable, MutableMapping
+from concurrent.futures import ProcessPoolExecutor
 from glob import iglob
+from itertools import islice
 
 import ruamel.yaml
 from ruamel.yaml import YAML
 
+from regolith import serializers
+from regolith.cache import CollectionCache, DEFAULT_CACHE_SIZE
+from regolith.query import Cursor, field_values, is_operator
 from regolith.tools import dbpathname
+from regolith.tracking import record
+
+DEFAULT_INDEXES = {
+    'citations': ['author'],
+    'projects': ['team.name'],
+    'grants': ['team.name'],
+    }
+"""Keys that are always indexed, since the builders look up the citations,
+projects, and grants of every person by name.
+"""
 
 
 def _id_key(doc):
     return doc['_id']
 
 
-def load_json(filename):
-    """Loads a JSON file and returns a dict of its documents."""
+def load_json(filename, batchsize=1000):
+    """Loads a JSON file and returns a dict of its documents. The file is
+    streamed line by line and the lines are parsed in batches, so that only
+    batchsize lines are held in memory at once.
+    """
     docs = {}
     with open(filename, encoding='utf-8') as fh:
-        lines = fh.readlines()
-    for line in lines:
-        doc = json.loads(line)
-        docs[doc['_id']] = doc
+        while True:
+            lines = list(islice(fh, batchsize))
+            if len(lines) == 0:
+                break
+            lines = [line for line in lines if not line.isspace()]
+            try:
+                batch = serializers.loads('[' + ','.join(lines) + ']')
+            except ValueError:
+                # parse line by line to report the offending line
+                batch = [serializers.loads(line) for line in lines]
+            for doc in batch:
+                docs[doc['_id']] = doc
     return docs
 
 
 def dump_json(filename, docs):
-    """Dumps a dict of documents into a file."""
+    """Dumps a dict of documents into a file, one document per line. The
+    documents are written out one at a time, in order of their ids.
+    """
     docs = sorted(docs.values(), key=_id_key)
-    lines = [json.dumps(doc, sort_keys=True) for doc in docs]
-    s = '\n'.join(lines)
-    with open(filename, 'w', encoding='utf-8') as fh:
-        fh.write(s)
+    with open(filename, 'w', encoding='utf-8', buffering=2**16) as fh:
+        for i, doc in enumerate(docs):
+            if i > 0:
+                fh.write('\n')
+            fh.write(serializers.dumps(doc))
 
 
 def load_yaml(filename, return_inst=False):
@@ -59,6 +89,31 @@ def dump_yaml(filename, docs, inst=None):
         inst.dump(sorted_dict, stream=fh)
 
 
+def load_collection(filename, filetype):
+    """Loads a single collection file of the given type ('json' or 'yaml').
+    This is the unit of work handed to the processes of a parallel load.
+    """
+    if filetype == 'json':
+        return load_json(filename)
+    elif filetype == 'yaml':
+        return load_yaml(filename)
+    else:
+        raise ValueError('did not recognize file type for regolith')
+
+
+class _Databases(dict):
+    """Maps database names to their lazy collections."""
+
+    def __init__(self, load_file, lock):
+        super().__init__()
+        self._load_file = load_file
+        self._lock = lock
+
+    def __missing__(self, key):
+        db = self[key] = LazyDatabase(self._load_file, self._lock)
+        return db
+
+
 def json_to_yaml(inp, out):
     """Converts a JSON file to a YAML one."""
     docs = load_json(inp)
@@ -71,58 +126,258 @@ def yaml_to_json(inp, out):
     dump_json(out, docs)
 
 
+class HashIndex:
+    """Maps the values of a (possibly dotted) key to the ids of the documents
+    that hold them, in the order that they were added.
+    """
+
+    def __init__(self, key, docs=()):
+        self.key = key
+        self._ids = defaultdict(dict)
+        for doc in docs:
+            self.add(doc)
+
+    def add(self, doc):
+        """Adds a document to the index."""
+        for value in field_values(doc, self.key):
+            if isinstance(value, Hashable):
+                self._ids[value][doc['_id']] = None
+
+    def remove(self, doc):
+        """Removes a document from the index."""
+        for value in field_values(doc, self.key):
+            if isinstance(value, Hashable):
+                ids = self._ids.get(value)
+                if ids is not None:
+                    ids.pop(doc['_id'], None)
+
+    def get(self, value):
+        """Returns the ids of the documents holding a value."""
+        if not isinstance(value, Hashable):
+            raise TypeError('cannot look up unhashable value '
+                            '{0!r}'.format(value))
+        return list(self._ids.get(value, ()))
+
+
+class LazyDatabase(MutableMapping):
+    """The collections of a single database. Collections that come from
+    files are only parsed the first time that they are accessed. Like a
+    defaultdict, accessing a collection that does not exist creates an empty
+    one.
+    """
+
+    def __init__(self, load_file, lock):
+        self._load_file = load_file
+        self._lock = lock
+        self._colls = {}
+        self._files = {}
+
+    def add_file(self, collname, filename, filetype):
+        """Adds a collection that will be parsed from a file on demand."""
+        self._files[collname] = (filename, filetype)
+
+    def pending(self):
+        """Returns a dict of the collections that have not been parsed yet,
+        mapping their names to (filename, filetype) tuples.
+        """
+        return dict(self._files)
+
+    def loaded(self):
+        """Returns a dict of the collections that are already in memory."""
+        return dict(self._colls)
+
+    def publish(self, key, value):
+        """Sets a collection that was parsed elsewhere, unless it is no
+        longer pending because it was parsed on demand in the meantime.
+        Returns whether it was set.
+        """
+        with self._lock:
+            if key not in self._files:
+                return False
+            self._colls[key] = value
+            del self._files[key]
+            return True
+
+    def __getitem__(self, key):
+        if key in self._colls:
+            return self._colls[key]
+        with self._lock:
+            if key in self._files:
+                filename, filetype = self._files[key]
+                print('loading ' + filename + '...', file=sys.stderr)
+                self._colls[key] = self._load_file(filename, filetype)
+                del self._files[key]
+            elif key not in self._colls:
+                self._colls[key] = {}
+            return self._colls[key]
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._colls[key] = value
+            self._files.pop(key, None)
+
+    def __delitem__(self, key):
+        with self._lock:
+            if key in self._files:
+                del self._files[key]
+            else:
+                del self._colls[key]
+
+    def __contains__(self, key):
+        return key in self._colls or key in self._files
+
+    def __iter__(self):
+        yield from list(self._colls)
+        yield from [k for k in list(self._files) if k not in self._colls]
+
+    def __len__(self):
+        return len(self._colls.keys() | self._files.keys())
+
+
 class FileSystemClient:
-    """A client database backed by the file system."""
+    """A client database backed by the file system.
+
+    Collections are parsed lazily, the first time that they are accessed, or
+    ahead of time in the background with ``prefetch()``. Parsed collections
+    are kept in a cache under ``builddir`` between runs. YAML instances only
+    carry formatting state, so every YAML collection gets a fresh one for
+    dumping.
+    """
 
     def __init__(self, rc):
         self.rc = rc
         self.closed = True
         self.dbs = None
         self.chained_db = None
+        self._lock = threading.RLock()
+        self._prefetcher = None
+        self._dirty = {}
+        self._indexes = {}
+        self._index_keys = defaultdict(set)
+        for indexes in (DEFAULT_INDEXES, getattr(rc, 'indexes', {})):
+            for collname, keys in indexes.items():
+                self._index_keys[collname].update(keys)
         self.open()
         self._collfiletypes = {}
         self._collexts = {}
         self._yamlinsts = {}
+        if getattr(rc, 'cache', True):
+            self.cache = CollectionCache(
+                os.path.join(rc.builddir, '_cache'),
+                maxsize=getattr(rc, 'cache_size', DEFAULT_CACHE_SIZE))
+        else:
+            self.cache = None
+        if hasattr(rc, 'json_backend'):
+            serializers.set_backend(rc.json_backend)
 
     def is_alive(self):
         return not self.closed
 
     def open(self):
-        self.dbs = defaultdict(lambda: defaultdict(dict))
+        self.dbs = _Databases(self.load_file, self._lock)
         self.chained_db = {}
         self.closed = False
 
     def load_json(self, db, dbpath):
-        """Loads the JSON part of a database."""
-        dbs = self.dbs
+        """Loads the JSON part of a database, to be parsed on demand."""
         for f in [file for file in iglob(os.path.join(dbpath, '*.json'))
                   if file not in db['blacklist']]:
             collfilename = os.path.split(f)[-1]
             base, ext = os.path.splitext(collfilename)
             self._collfiletypes[base] = 'json'
-            print('loading ' + f + '...', file=sys.stderr)
-            dbs[db['name']][base] = load_json(f)
+            self.dbs[db['name']].add_file(base, f, 'json')
 
     def load_yaml(self, db, dbpath):
-        """Loads the YAML part of a database."""
-        dbs = self.dbs
+        """Loads the YAML part of a database, to be parsed on demand."""
         for f in [file for file in iglob(os.path.join(dbpath, '*.y*ml'))
                   if file not in db['blacklist']]:
             collfilename = os.path.split(f)[-1]
             base, ext = os.path.splitext(collfilename)
             self._collexts[base] = ext
             self._collfiletypes[base] = 'yaml'
-            print('loading ' + f + '...', file=sys.stderr)
-            coll, inst = load_yaml(f, return_inst=True)
-            dbs[db['name']][base] = coll
-            self._yamlinsts[dbpath, base] = inst
+            self._yamlinsts[dbpath, base] = YAML()
+            self.dbs[db['name']].add_file(base, f, 'yaml')
+
+    def load_file(self, f, filetype):
+        """Loads a single collection file, going through the cache of
+        parsed collections when it is enabled.
+        """
+        docs = None if self.cache is None else self.cache.get(f)
+        if docs is None:
+            docs = load_collection(f, filetype)
+            if self.cache is not None:
+                self.cache.put(f, docs)
+        return docs
 
     def load_database(self, db):
-        """Loads a database."""
+        """Loads a database. Its collections are only parsed once they are
+        accessed or prefetched.
+        """
         dbpath = dbpathname(db, self.rc)
         self.load_json(db, dbpath)
         self.load_yaml(db, dbpath)
 
+    def load_collections(self, collnames):
+        """Parses the named collections of all databases that have not been
+        parsed yet. When the nprocs run control value is greater than one,
+        the files are parsed concurrently by a pool of worker processes.
+        The lock is only held to publish each parsed collection, so that
+        other collections can still be loaded on demand meanwhile.
+        """
+        with self._lock:
+            pending = []
+            for db in self.dbs.values():
+                files = db.pending()
+                pending += [(db, c) + files[c] for c in collnames
+                            if c in files]
+        nprocs = getattr(self.rc, 'nprocs', 1)
+        if nprocs < 2 or len(pending) < 2:
+            for db, collname, f, filetype in pending:
+                db[collname]
+            return
+        cached = {}
+        if self.cache is not None:
+            for db, collname, f, filetype in pending:
+                docs = self.cache.get(f)
+                if docs is not None:
+                    cached[f] = docs
+        # schedule the largest files first, so that one giant collection
+        # does not start (and finish) last
+        schedule = sorted([x for x in pending if x[2] not in cached],
+                          key=lambda x: os.path.getsize(x[2]),
+                          reverse=True)
+        executor = ProcessPoolExecutor(
+            max_workers=nprocs, initializer=serializers.set_backend,
+            initargs=(serializers.BACKEND,))
+        with executor:
+            futures = {f: executor.submit(load_collection, f, filetype)
+                       for _, _, f, filetype in schedule}
+            for db, collname, f, filetype in pending:
+                docs = cached[f] if f in cached else futures[f].result()
+                with self._lock:
+                    if not db.publish(collname, docs):
+                        continue
+                    print('loading ' + f + '...', file=sys.stderr)
+                    if f not in cached and self.cache is not None:
+                        self.cache.put(f, docs)
+
+    def prefetch(self, collnames):
+        """Starts parsing the named collections in a background thread.
+        Accessing a collection before it has been parsed there parses it
+        right away, rather than waiting for the others.
+        """
+        self.wait()
+        self._prefetcher = threading.Thread(target=self.load_collections,
+                                            args=(list(collnames),),
+                                            daemon=True)
+        self._prefetcher.start()
+
+    def wait(self):
+        """Waits for any prefetching to finish."""
+        if self._prefetcher is not None:
+            self._prefetcher.join()
+            self._prefetcher = None
+
     def dump_json(self, docs, collname, dbpath):
         """Dumps json docs and returns filename"""
         f = os.path.join(dbpath, collname + '.json')
@@ -143,7 +398,11 @@ class FileSystemClient:
         dbpath = dbpathname(db, self.rc)
         os.makedirs(dbpath, exist_ok=True)
         to_add = []
-        for collname, collection in self.dbs[db['name']].items():
+        self.wait()
+        # only collections that were written to have changed
+        for collname, collection in self.dbs[db['name']].loaded().items():
+            if (db['name'], collname) not in self._dirty:
+                continue
             print('dumping ' + collname + '...', file=sys.stderr)
             filetype = self._collfiletypes.get(collname, 'yaml')
             if filetype == 'json':
@@ -153,9 +412,26 @@ class FileSystemClient:
             else:
                 raise ValueError('did not recognize file type for regolith')
             to_add.append(os.path.join(db['path'], filename))
+            del self._dirty[db['name'], collname]
         return to_add
 
+    def mark_dirty(self, dbname, collname, ids=()):
+        """Records that documents in a collection were written to, so that
+        the collection is dumped back to the filesystem and the documents are
+        merged again in ``chained_db``.
+        """
+        self._dirty.setdefault((dbname, collname), set()).update(ids)
+        if hasattr(self.chained_db, 'refresh'):
+            self.chained_db.refresh(collname, ids)
+
+    def dirty_documents(self, dbname, collname):
+        """Returns the ids of the documents in a collection that were written
+        to since the last dump, or None if the collection is unchanged.
+        """
+        return self._dirty.get((dbname, collname), None)
+
     def close(self):
+        self.wait()
         self.dbs = None
         self.closed = True
 
@@ -171,40 +447,143 @@ class FileSystemClient:
 
     def all_documents(self, collname):
         """Returns an iteratable over all documents in a collection."""
+        record(collname)
         return self.chained_db.get(collname, {}).values()
 
-    def insert_one(self, dbname, collname, doc):
-        """Inserts one document to a database/collection."""
+    def create_index(self, collname, key):
+        """Declares a hash index on a (possibly dotted) key of a collection,
+        in every database. Indexes are built the first time they are used
+        and are kept up to date by the insert, update, and delete methods.
+        Documents are always looked up by ``_id`` directly.
+        """
+        self._index_keys[collname].add(key)
+        for (dbname, cname), indexes in self._indexes.items():
+            if cname == collname and key not in indexes:
+                indexes[key] = HashIndex(key, self.dbs[dbname][cname].values())
+
+    def get_index(self, dbname, collname, key):
+        """Returns the index on a key of a collection, or None if the key is
+        not indexed.
+        """
+        if key not in self._index_keys.get(collname, ()):
+            return None
+        with self._lock:
+            indexes = self._indexes.setdefault((dbname, collname), {})
+            if key not in indexes:
+                coll = self.dbs[dbname][collname]
+                indexes[key] = HashIndex(key, coll.values())
+            return indexes[key]
+
+    def _put(self, dbname, collname, doc):
         coll = self.dbs[dbname][collname]
+        indexes = self._indexes.get((dbname, collname), {})
+        old = coll.get(doc['_id'])
+        for index in indexes.values():
+            if old is not None:
+                index.remove(old)
+            index.add(doc)
         coll[doc['_id']] = doc
 
+    def insert_one(self, dbname, collname, doc):
+        """Inserts one document to a database/collection."""
+        self._put(dbname, collname, doc)
+        self.mark_dirty(dbname, collname, [doc['_id']])
+
     def insert_many(self, dbname, collname, docs):
         """Inserts many documents into a database/collection."""
-        coll = self.dbs[dbname][collname]
+        ids = []
         for doc in docs:
-            coll[doc['_id']] = doc
+            self._put(dbname, collname, doc)
+            ids.append(doc['_id'])
+        self.mark_dirty(dbname, collname, ids)
 
     def delete_one(self, dbname, collname, doc):
         """Removes a single document from a collection"""
         coll = self.dbs[dbname][collname]
-        del coll[doc['_id']]
+        old = coll.pop(doc['_id'])
+        for index in self._indexes.get((dbname, collname), {}).values():
+            index.remove(old)
+        self.mark_dirty(dbname, collname, [doc['_id']])
+
+    def _index_ids(self, dbnames, collname, filter):
+        """Returns the ids of the documents that may match a filter, from
+        their ``_id`` or from an index, or None if neither applies.
+        """
+        for key, cond in filter.items():
+            if not is_operator(cond):
+                values = [cond]
+            elif set(cond) == {'$eq'}:
+                values = [cond['$eq']]
+            elif set(cond) == {'$in'}:
+                values = cond['$in']
+            else:
+                continue
+            if not all(isinstance(v, Hashable) for v in values):
+                continue
+            if key == '_id':
+                return list(dict.fromkeys(values))
+            elif None in values:
+                # null also matches the documents that lack the key, which
+                # are not in the index
+                continue
+            indexes = [self.get_index(dbname, collname, key)
+                       for dbname in dbnames]
+            if len(indexes) == 0 or None in indexes:
+                continue
+            ids = {}
+            for index in indexes:
+                for value in values:
+                    ids.update(dict.fromkeys(index.get(value)))
+            return list(ids)
+        return None
+
+    def find(self, dbname, collname, filter=None, projection=None, sort=None,
+             limit=None):
+        """Returns a lazy cursor over the documents of a collection that
+        match a filter, see ``regolith.query``. If dbname is None, the
+        collection is searched across all databases, as in ``chained_db``.
+        The ``_id`` and indexes are used to narrow down the search whenever
+        the filter allows it.
+        """
+        record(collname)
+        if dbname is None:
+            coll = self.chained_db.get(collname, {})
+            dbnames = [name for name in getattr(self.chained_db, 'dbnames', ())
+                       if collname in self.dbs.get(name, ())]
+        else:
+            coll = self.dbs[dbname][collname]
+            dbnames = [dbname]
+        ids = None if not filter else self._index_ids(dbnames, collname,
+                                                      filter)
+        docs = coll.values() if ids is None else \
+            [coll[i] for i in ids if i in coll]
+        return Cursor(docs, filter=filter, projection=projection, sort=sort,
+                      limit=limit)
 
     def find_one(self, dbname, collname, filter):
         """Finds the first document matching filter."""
-        coll = self.dbs[dbname][collname]
-        for doc in coll.values():
-            matches = True
-            for key, value in filter.items():
-                if key not in doc or doc[key] != value:
-                    matches = False
-                    break
-            if matches:
-                return doc
+        for doc in self.find(dbname, collname, filter, limit=1):
+            return doc
 
     def update_one(self, dbname, collname, filter, update, **kwargs):
         """Updates one document."""
-        coll = self.dbs[dbname][collname]
         doc = self.find_one(dbname, collname, filter)
         newdoc = dict(filter if doc is None else doc)
         newdoc.update(update)
-        coll[newdoc['_id']] = newdoc
+        self._put(dbname, collname, newdoc)
+        self.mark_dirty(dbname, collname, [newdoc['_id']])
+
+    def bulk_upsert(self, dbname, collname, docs):
+        """Upserts many documents in a single pass. Each document updates the
+        stored document with the same ``_id``, or is inserted if there is
+        none, just like ``update_one()`` with an ``_id`` filter.
+        """
+        coll = self.dbs[dbname][collname]
+        ids = []
+        for doc in docs:
+            old = coll.get(doc['_id'])
+            newdoc = dict(doc if old is None else old)
+            newdoc.update(doc)
+            self._put(dbname, collname, newdoc)
+            ids.append(doc['_id'])
+        self.mark_dirty(dbname, collname, ids)
@@ -0,0 +1,344 @@
+"""Dense arrays of the grades of a course, for computing totals, averages,
+curves, and letter grades of all of its students at once.
+
+The scores of a course are loaded once into an array whose axes are the
+students, the assignments, and the questions of the assignments, with a mask
+of which students were graded for which assignments. Assignments with fewer
+questions than others are padded with zero points, and missing grades count
+as zero points scored.
+
+The statistics of every assignment of every course are computed together,
+see ``grade_stats()``.
+"""
+from collections import namedtuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import scipy.stats as st
+except ImportError:
+    st = None
+
+DEFAULT_LETTER_SCALE = (
+    (0.97, "A+"),
+    (0.93, "A"),
+    (0.90, "A-"),
+    (0.87, "B+"),
+    (0.83, "B"),
+    (0.80, "B-"),
+    (0.77, "C+"),
+    (0.73, "C"),
+    (0.70, "C-"),
+    (0.67, "D+"),
+    (0.63, "D"),
+    (0.60, "D-"),
+    (-1.0, "F"),
+    )
+
+
+def _dtype(rows):
+    """Returns int if all of the values in rows of numbers are integers, so
+    that their sums are printed as integers, or float otherwise."""
+    if all(isinstance(v, int) for row in rows for v in row):
+        return int
+    return float
+
+
+def _ranks(scores, scale):
+    """Returns the order of the letters of a scale, from the lowest up, and
+    the rank in that order of the letter of each score. Scores that are not
+    finite, such as NaN, get the lowest letter."""
+    order = sorted(range(len(scale)), key=lambda i: scale[i][0])
+    lowers = np.array([scale[i][0] for i in order], dtype=float)
+    scores = np.asarray(scores, dtype=float)
+    ranks = np.searchsorted(lowers, scores, side='right') - 1
+    ranks[~np.isfinite(scores)] = 0
+    return np.array(order, dtype=int), np.maximum(ranks, 0)
+
+
+def letter_indices(scores, scale=DEFAULT_LETTER_SCALE):
+    """Returns the indices into scale of the letter grades of an array of
+    scores. Each score gets the letter with the highest lower bound that is
+    not above it, or the lowest letter if the score is below all of them or
+    is not finite.
+    """
+    order, ranks = _ranks(scores, scale)
+    return order[ranks]
+
+
+class LetterGrades(namedtuple('LetterGrades', ['letters', 'raw', 'curved',
+                                               'raw_counts',
+                                               'curved_counts'])):
+    """The letter grades of the students of a course. The letters are those
+    of the scale, from the lowest up, and the counts are the number of
+    students with each of them.
+    """
+    __slots__ = ()
+
+
+def letter_grades(raw, curved, scale=DEFAULT_LETTER_SCALE):
+    """Finds the letter grades of arrays of raw and curved weighted averages,
+    and counts how many there are of each letter.
+
+    Parameters
+    ----------
+    raw, curved : array-likes of floats
+        The raw and curved weighted averages of the students.
+    scale : sequence of (float, str) pairs, optional
+        The lower bound of each letter grade, such as the ``scale`` of a
+        course. The pairs need not be sorted.
+
+    Returns
+    -------
+    grades : LetterGrades
+    """
+    order, raw_ranks = _ranks(raw, scale)
+    _, curved_ranks = _ranks(curved, scale)
+    letters = [scale[i][1] for i in order]
+    return LetterGrades(letters, [letters[r] for r in raw_ranks],
+                        [letters[r] for r in curved_ranks],
+                        np.bincount(raw_ranks, minlength=len(scale)),
+                        np.bincount(curved_ranks, minlength=len(scale)))
+
+
+def _above(fracs, maxs, mu, sig):
+    return [1.0 - st.norm.cdf(frac * maxs, mu, sig) for frac in fracs]
+
+
+def zero_stats(nquestions):
+    """Returns the statistics of an assignment that has not been graded."""
+    z = (0,) * nquestions
+    return (z, z, z, z, z, 0, 0, 0, 0, 0)
+
+
+def grade_stats(grades):
+    """Computes the statistics of the scores of all of the assignments of
+    all of the courses at once.
+
+    Parameters
+    ----------
+    grades : iterable of dicts
+        Grade documents. All of the grades of an assignment in a course
+        should have the same number of scores, though those of different
+        assignments need not.
+
+    Returns
+    -------
+    stats : dict
+        Maps course ids to dicts that map the ids of their graded assignments
+        to a (mean, std, max, fraction above 60%, fraction above 80%) tuple
+        of arrays over the questions, followed by the same five statistics
+        of the assignment totals. The fractions assume normally distributed
+        scores.
+    """
+    keys = {}
+    group = []
+    rows = []
+    for grade in grades:
+        if 'course' not in grade:
+            continue
+        key = (grade['course'], grade['assignment'])
+        group.append(keys.setdefault(key, len(keys)))
+        rows.append(grade['scores'])
+    if len(rows) == 0:
+        return {}
+    lens = np.array([len(row) for row in rows])
+    # integer scores keep integer maxima, as they would in Python
+    data = np.zeros((len(rows), lens.max()), dtype=_dtype(rows))
+    for k, row in enumerate(rows):
+        data[k, :len(row)] = row
+    # bucket the grades of each assignment together
+    group = np.array(group)
+    order = np.argsort(group, kind='stable')
+    group, data, lens = group[order], data[order], lens[order]
+    starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+    counts = np.diff(np.r_[starts, len(group)])
+    nqs = np.maximum.reduceat(lens, starts)
+    # per question
+    mu = np.add.reduceat(data, starts) / counts[:, None]
+    sig = np.sqrt(np.add.reduceat((data - mu[group]) ** 2, starts) /
+                  counts[:, None])
+    maxs = np.maximum.reduceat(data, starts)
+    above60, above80 = _above((0.6, 0.8), maxs, mu, sig)
+    # per assignment total
+    totals = data.sum(axis=1)
+    total_mu = np.add.reduceat(totals, starts) / counts
+    total_sig = np.sqrt(np.add.reduceat((totals - total_mu[group]) ** 2,
+                                        starts) / counts)
+    total_maxs = np.maximum.reduceat(totals, starts)
+    total_above60, total_above80 = _above((0.6, 0.8), total_maxs, total_mu,
+                                          total_sig)
+    stats = {}
+    for (course_id, assignment_id), g in keys.items():
+        n = nqs[g]
+        stats.setdefault(course_id, {})[assignment_id] = (
+            mu[g, :n], sig[g, :n], maxs[g, :n], above60[g, :n],
+            above80[g, :n], total_mu[g], total_sig[g], total_maxs[g],
+            total_above60[g], total_above80[g],
+            )
+    return stats
+
+
+class Gradebook(object):
+    """The grades of a course.
+
+    Parameters
+    ----------
+    course : dict
+        The course document.
+    assignments : iterable of dicts
+        Assignment documents, of which those of the course are kept.
+    grades : iterable of dicts
+        Grade documents, of which those of the course's students and
+        assignments are kept. If a student has several grades for an
+        assignment, the first one is used.
+
+    Attributes
+    ----------
+    students : list of str
+        The ids of the students, in the order of the course.
+    assignments : list of dicts
+        The assignments of the course, sorted by category and then id.
+    categories : list of str
+        The sorted categories of the assignments.
+    points : array of shape (assignments, questions)
+        The points possible for each question. Integers if all of the
+        points are, or else floats.
+    scores : array of shape (students, assignments, questions)
+        The points scored for each question, zero if not graded. Integers if
+        all of the scores are, or else floats.
+    graded : bool array of shape (students, assignments)
+        Whether each student was graded for each assignment.
+    """
+
+    def __init__(self, course, assignments, grades):
+        self.course = course
+        course_id = course['_id']
+        self.students = list(course['students'])
+        self.assignments = sorted(
+            (a for a in assignments if course_id in a['courses']),
+            key=lambda a: (a['category'], a['_id']))
+        cats = [a['category'] for a in self.assignments]
+        self.categories = sorted(set(cats))
+        self._starts = [cats.index(c) for c in self.categories]
+        nq = max([len(a['points']) for a in self.assignments] or [0])
+        self.points = np.zeros((len(self.assignments), nq),
+                               dtype=_dtype(a['points']
+                                            for a in self.assignments))
+        for j, a in enumerate(self.assignments):
+            self.points[j, :len(a['points'])] = a['points']
+        shape = (len(self.students), len(self.assignments))
+        self.graded = np.zeros(shape, dtype=bool)
+        self._docs = {}
+        sidx = {s: i for i, s in enumerate(self.students)}
+        aidx = {a['_id']: j for j, a in enumerate(self.assignments)}
+        for grade in grades:
+            if grade.get('course') != course_id:
+                continue
+            i = sidx.get(grade['student'])
+            j = aidx.get(grade['assignment'])
+            if i is None or j is None or self.graded[i, j]:
+                continue
+            self.graded[i, j] = True
+            self._docs[i, j] = grade
+        self.scores = np.zeros(shape + (nq,), dtype=_dtype(
+            grade['scores'] for grade in self._docs.values()))
+        for (i, j), grade in self._docs.items():
+            self.scores[i, j, :len(grade['scores'])] = grade['scores']
+
+    def _by_category(self, a, axis=-1):
+        if len(self.assignments) == 0:
+            shape = list(a.shape)
+            shape[axis] = 0
+            return np.zeros(shape)
+        return np.add.reduceat(a, self._starts, axis=axis)
+
+    @property
+    def weights(self):
+        """The weight of each category in the course, as integers if all of
+        the weights are, or else floats."""
+        weights = [self.course['weights'][c] for c in self.categories]
+        return np.array(weights, dtype=_dtype([weights]))
+
+    def category_max(self):
+        """Returns the points possible in each category."""
+        return self._by_category(self.points.sum(axis=1))
+
+    def category_totals(self):
+        """Returns the points that each student scored in each category, as
+        an array of shape (students, categories).
+        """
+        return self._by_category(self.scores.sum(axis=2), axis=1)
+
+    def weighted_fractions(self):
+        """Returns the weighted fraction of the points possible that each
+        student scored in each category. A ValueError is raised if a
+        category has no points possible.
+        """
+        maxs = self.category_max()
+        empty = [c for c, m in zip(self.categories, maxs.tolist()) if m == 0]
+        if empty:
+            raise ValueError('course {0!r} has no points possible in: '
+                             '{1}'.format(self.course['_id'],
+                                          ', '.join(empty)))
+        return self.category_totals() / maxs * self.weights.astype(float)
+
+    def weighted_averages(self, wfracs=None):
+        """Returns the weighted average of each student, from 0 to 1. The
+        weighted fractions of all students may be passed in, if they are
+        already known. A ValueError is raised if the weights sum to zero.
+        """
+        if wfracs is None:
+            wfracs = self.weighted_fractions()
+        total = self.weights.sum(dtype=float)
+        if total == 0:
+            raise ValueError('the weights of course {0!r} sum to zero, or it '
+                             'has no assignments'.format(self.course['_id']))
+        return wfracs.sum(axis=1) / total
+
+    @staticmethod
+    def curve(wavgs):
+        """Returns the curve that raises the best weighted average to 1."""
+        return 1.0 - np.max(wavgs)
+
+    def letter_grades(self, wavgs, curve):
+        """Returns the raw and curved letter grades of weighted averages, see
+        ``letter_grades()``, on the scale of the course.
+        """
+        return letter_grades(wavgs, wavgs + curve,
+                             self.course.get('scale', DEFAULT_LETTER_SCALE))
+
+    def grouped_assignments(self):
+        """Returns a dict that maps each category to its assignments."""
+        grouped = {c: [] for c in self.categories}
+        for a in self.assignments:
+            grouped[a['category']].append(a)
+        return grouped
+
+    def student_grades(self, i):
+        """Returns a dict that maps each category to the grade documents of
+        the ith student for its assignments, or None where not graded.
+        """
+        grades = {c: [] for c in self.categories}
+        for j, a in enumerate(self.assignments):
+            grades[a['category']].append(self._docs.get((i, j)))
+        return grades
+
+    def student_totals(self, i, totals=None, wfracs=None):
+        """Returns the (category, score, max, weight, weighted fraction)
+        rows of the ith student, sorted by category. The category totals and
+        weighted fractions of all students may be passed in, if they are
+        already known.
+        """
+        if totals is None:
+            totals = self.category_totals()
+        if wfracs is None:
+            wfracs = self.weighted_fractions()
+        return [list(row) for row in zip(self.categories,
+                                         totals[i].tolist(),
+                                         self.category_max().tolist(),
+                                         self.weights.tolist(),
+                                         wfracs[i].tolist())]
@@ -1,35 +1,24 @@
 """Builder for Grade Reports."""
+import io
 import os
+import re
 import sys
 import pdb
-import shutil
 import traceback
-import subprocess
 from glob import glob
-from itertools import groupby
-
-from jinja2 import Environment, FileSystemLoader, StrictUndefined
-try:
-    from bibtexparser.bwriter import BibTexWriter
-    from bibtexparser.bibdatabase import BibDatabase
-    HAVE_BIBTEX_PARSER = True
-except ImportError:
-    HAVE_BIBTEX_PARSER = False
 
 try:
     import numpy as np
 except ImportError:
     np = None
 
-try:
-    import scipy.stats as st
-except ImportError:
-    st = None
-
-from regolith.tools import all_docs_from_collection, date_to_rfc822, rfc822now, gets, month_and_year
-from regolith.dates import date_to_float
-from regolith.sorters import doc_date_key, ene_date_key, category_val, \
-    level_val, id_key, date_key, position_key
+from regolith.basebuilder import BuilderBase
+from regolith.gradebook import DEFAULT_LETTER_SCALE, Gradebook, \
+    grade_stats, letter_indices, zero_stats
+from regolith.latex import split_pdf
+from regolith.tools import all_docs_from_collection, month_and_year, \
+    find_docs_from_collection
+from regolith.tracking import TrackedList
 
 LATEX_OPTS = ['-halt-on-error', '-file-line-error']
 
@@ -37,141 +26,139 @@ def latex_safe(s):
     return s.replace('&', '\&').replace('$', '\$').replace('#', '\#')
 
 
-class GradeReportBuilder(object):
+class GradeReportBuilder(BuilderBase):
+    """Build grade reports from database entries
 
+    With ``rc.batch_grades`` set, the reports of each course are rendered
+    into one LaTeX document, named after the course, which is compiled once
+    and then split into a PDF for each student.
+    """
     btype = 'grades'
+    needed_colls = ('grades', 'courses', 'assignments')
+    derived_exts = ('.pdf', '.aux')
 
     def __init__(self, rc):
-        self.rc = rc
-        self.bldir = os.path.join(rc.builddir, self.btype)
-        self.env = Environment(loader=FileSystemLoader([
-                    'templates',
-                    os.path.join(os.path.dirname(__file__), 'templates'),
-                    ]),
-                    )
-        self.construct_global_ctx()
-        if HAVE_BIBTEX_PARSER:
-            self.bibdb = BibDatabase()
-            self.bibwriter = BibTexWriter()
+        super().__init__(rc)
+        self.cmds = ['latex', 'pdf', 'clean']
+        self._stats = None
+        self.reports = {}
 
     def construct_global_ctx(self):
-        self.gtx = gtx = {}
+        """Constructs the global context"""
+        super().construct_global_ctx()
+        gtx = self.gtx
         rc = self.rc
-        gtx['len'] = len
         gtx['sum'] = sum
         gtx['zip'] = zip
-        gtx['True'] = True
-        gtx['False'] = False
-        gtx['None'] = None
-        gtx['sorted'] = sorted
-        gtx['groupby'] = groupby
         gtx['range'] = range
-        gtx['gets'] = gets
         gtx['id_key'] = lambda x: x['_id']
-        gtx['date_key'] = date_key
-        gtx['doc_date_key'] = doc_date_key
-        gtx['level_val'] = level_val
-        gtx['category_val'] = category_val
-        gtx['rfc822now'] = rfc822now
-        gtx['date_to_rfc822'] = date_to_rfc822
         gtx['month_and_year'] = month_and_year
         gtx['latex_safe'] = latex_safe
         gtx['all_docs_from_collection'] = all_docs_from_collection
-        gtx['grades'] = list(all_docs_from_collection(rc.client, 'grades'))
-        gtx['courses'] = list(all_docs_from_collection(rc.client, 'courses'))
-        gtx['assignments'] = list(all_docs_from_collection(rc.client,
-                                                           'assignments'))
+        for collname in self.needed_colls:
+            gtx[collname] = TrackedList(
+                collname, all_docs_from_collection(rc.client, collname))
 
     def render(self, tname, fname, **kwargs):
-        template = self.env.get_template(tname)
-        ctx = dict(self.gtx)
-        ctx.update(kwargs)
-        ctx['rc'] = ctx.get('rc', self.rc)
-        ctx['static'] = ctx.get('static',
-                               os.path.relpath('static', os.path.dirname(fname)))
-        ctx['root'] = ctx.get('root', os.path.relpath('/', os.path.dirname(fname)))
+        """Render the template into a file, starting the debugger if that
+        fails"""
         try:
-            result = template.render(ctx)
-        except:
+            return super().render(tname, fname, **kwargs)
+        except Exception:
             type, value, tb = sys.exc_info()
             traceback.print_exc()
             pdb.post_mortem(tb)
-        with open(os.path.join(self.bldir, fname), 'wt') as f:
-            f.write(result)
-
-    def build(self):
-        os.makedirs(self.bldir, exist_ok=True)
-        self.latex()
-        self.clean()
 
     def latex(self):
         rc = self.rc
+        self.bases = []
+        self.reports = {}
         for course in self.gtx['courses']:
             if not course.get('active', True):
                 continue
             course_id = course['_id']
             stats = self.makestats(course)
-            asgn = filter((lambda x: course_id in x['courses']),
-                          self.gtx['assignments'])
-            catfunc = lambda x: x['category']
-            asgn = sorted(asgn, key=catfunc)
-            grouped_assignments = {k: sorted(i, key=lambda x: x['_id']) \
-                                   for k, i in groupby(asgn, catfunc)}
-
-            student_wavgs = []
+            book = Gradebook(course, self.gtx['assignments'],
+                             find_docs_from_collection(rc.client, 'grades',
+                                                       {'course': course_id}))
+            grouped_assignments = book.grouped_assignments()
+            totals = book.category_totals()
+            wfracs = book.weighted_fractions()
+            wavgs = book.weighted_averages(wfracs)
+            max_wavg = float(np.max(wavgs))
+            curve = book.curve(wavgs)
+            # Make grades
+            letters = book.letter_grades(wavgs, curve)
             students_kwargs = {}
-            for student_id in course['students']:
-                student_grade_list = list(filter(
-                    (lambda x: (x['student'] == student_id and
-                               x['course'] == course_id)), self.gtx['grades']))
-                student_grades = {k: [] for k in grouped_assignments.keys()}
-                for category, asngs in grouped_assignments.items():
-                    for asgn in asngs:
-                        for sg in student_grade_list:
-                            if sg['assignment'] == asgn['_id']:
-                                student_grades[category].append(sg)
-                                break
-                        else:
-                            student_grades[category].append(None)
-                student_totals, student_wavg = self.maketotals(student_grades,
-                                                               grouped_assignments,
-                                                               course)
-                student_wavgs.append(student_wavg)
+            for i, student_id in enumerate(book.students):
                 students_kwargs[student_id] = dict(
-                    title=student_id, stats=stats,
-                    student_id=student_id, course_id=course_id,
-                    grouped_assignments=grouped_assignments,
-                    student_grades=student_grades,
-                    student_totals=student_totals,
-                    student_wavg=student_wavg
+                    student_id=student_id,
+                    student_grades=book.student_grades(i),
+                    student_totals=book.student_totals(i, totals, wfracs),
+                    student_wavg=float(wavgs[i]),
+                    student_letter_grade_raw=letters.raw[i],
+                    student_letter_grade_curved=letters.curved[i],
                     )
-            max_wavg = max(student_wavgs)
-            curve = 1.0 - max_wavg
-            # Make grades
-            scale = course.get('scale', DEFAULT_LETTER_SCALE)
-            for student_id in course['students']:
-                skw = students_kwargs[student_id]
-                skw['student_letter_grade_raw'] = find_letter_grade(
-                    skw['student_wavg'], scale)
-                skw['student_letter_grade_curved'] = find_letter_grade(
-                    skw['student_wavg'] + curve, scale)
-            show_letter_plot = self.plot_letter_grades(students_kwargs, scale)
+            letter_plot = self.plot_letter_grades(letters, course_id)
+            plots = [] if letter_plot is None else [letter_plot + '.eps']
             # render PDF
+            course_kwargs = dict(
+                course_id=course_id, stats=stats,
+                grouped_assignments=grouped_assignments, max_wavg=max_wavg,
+                curve=curve, letter_plot=letter_plot)
+            if getattr(rc, 'batch_grades', False):
+                self.add_file_inputs(course_id + '.tex', plots)
+                self.latex_batch(course, students_kwargs, course_kwargs)
+                continue
             for student_id in course['students']:
                 base = self.basename(student_id, course_id)
+                # the PDF is compiled from its own report now, not split
+                # from the course's
+                self.manifest.remove(self.btype, base + '.pdf')
+                self.add_file_inputs(base + '.tex', plots)
                 self.render('gradereport.tex', base + '.tex', p=student_id,
-                            max_wavg=max_wavg, curve=curve,
-                            show_letter_plot=show_letter_plot,
+                            title=student_id, **course_kwargs,
                             **students_kwargs[student_id])
-                self.pdf(base)
+                self.bases.append(base)
 
-    def pdf(self, base):
-        """Compiles latex files to PDF"""
-        self.run(['latex'] + LATEX_OPTS + [base + '.tex'])
-        self.run(['dvipdf', base])
+    def latex_batch(self, course, students_kwargs, course_kwargs):
+        """Renders the reports of all of the students of a course into one
+        document, whose PDF is split into the students' reports. The split
+        PDFs are recorded in the manifest, so that those of students who
+        have left the course are removed by ``remove_stale()``.
+        """
+        course_id = course['_id']
+        names = [self.basename(s, course_id) for s in course['students']]
+        # the reports are no longer rendered one at a time
+        for name in names:
+            path = os.path.join(self.bldir, name + '.tex')
+            if os.path.isfile(path):
+                os.remove(path)
+            self.manifest.remove(self.btype, name + '.tex')
+            self.manifest.set(self.btype, name + '.pdf', {'batch': course_id})
+            self.visited.add(name + '.pdf')
+        self.render('gradereports.tex', course_id + '.tex',
+                    title=course_id, **course_kwargs,
+                    reports=[students_kwargs[s] for s in course['students']])
+        self.bases.append(course_id)
+        self.reports[course_id] = names
 
-    def run(self, cmd):
-        subprocess.run(cmd, cwd=self.bldir, check=True)
+    def pdf(self):
+        """Compiles latex files to PDF, several reports at once, and splits
+        batches of reports into a PDF for each student"""
+        jobs = {}
+        for base in self.bases:
+            steps = []
+            if self.outdated(base + '.tex', base + '.pdf'):
+                steps += [['latex'] + LATEX_OPTS + [base + '.tex'],
+                          ['dvipdf', base]]
+            names = self.reports.get(base, [])
+            if any(self.outdated(base + '.tex', name + '.pdf')
+                   for name in names):
+                steps.append(split_pdf(base, self.bldir, names))
+            if steps:
+                jobs[base] = steps
+        self.run_jobs(jobs)
 
     def clean(self):
         postfixes = ['*.dvi', '*.toc', '*.aux', '*.out', '*.log', '*.bbl',
@@ -180,50 +167,27 @@ class GradeReportBuilder(object):
         to_rm = []
         for pst in postfixes:
             to_rm += glob(os.path.join(self.bldir, pst))
-        for f in set(to_rm):
+        # the aux files of batches are kept, since they tell how to split
+        # their PDFs again
+        to_rm = set(to_rm) - {os.path.join(self.bldir, base + '.aux')
+                              for base in self.reports}
+        for f in to_rm:
             os.remove(f)
 
     def makestats(self, course):
         """Returns a dictionary of statistics for a course whose keys are
         the assignments and whose values are a (mean-problem, std-problem,
-        mean-total, std-total) tuple.
+        mean-total, std-total) tuple. The statistics of all of the courses
+        are computed together, the first time that this is called.
         """
-        scores = {}
-        course_id = course['_id']
-        for grade in self.gtx['grades']:
-            if grade['course'] != course_id:
-                 continue
-            assignment_id = grade['assignment']
-            if assignment_id not in scores:
-                scores[assignment_id] = []
-            scores[assignment_id].append(grade['scores'])
-        stats = {}
-        for assignment_id, data in scores.items():
-            mu = np.mean(data, axis=0)
-            sig = np.std(data, axis=0)
-            max_score = np.max(data, axis=0)
-            norm = st.norm(mu, sig)
-            percent_above_60 = 1.0 - norm.cdf(0.6 * max_score)
-            percent_above_80 = 1.0 - norm.cdf(0.8 * max_score)
-            total = np.sum(data, axis=1)
-            total_mu = np.mean(total, axis=0)
-            total_sig = np.std(total, axis=0)
-            total_max_score = np.max(total, axis=0)
-            total_norm = st.norm(total_mu, total_sig)
-            total_percent_above_60 = 1.0 - total_norm.cdf(0.6 * total_max_score)
-            total_percent_above_80 = 1.0 - total_norm.cdf(0.8 * total_max_score)
-            stats[assignment_id] = (
-                mu, sig, max_score, percent_above_60, percent_above_80,
-                total_mu, total_sig, total_max_score, total_percent_above_60,
-                total_percent_above_80,
-                )
+        if self._stats is None:
+            self._stats = grade_stats(self.gtx['grades'])
+        stats = dict(self._stats.get(course['_id'], {}))
         # handle stats for ungraded assignments
         for assignment in self.gtx['assignments']:
-            assignment_id = assignment['_id']
-            if assignment_id not in stats:
-                n = len(assignment['points'])
-                z = (0,) * n
-                stats[assignment_id] = (z, z, z, z, z, 0, 0, 0, 0, 0)
+            if assignment['_id'] not in stats:
+                stats[assignment['_id']] = zero_stats(
+                    len(assignment['points']))
         return stats
 
     @staticmethod
@@ -233,47 +197,18 @@ class GradeReportBuilder(object):
         name += '-' + course_id
         return name
 
-    def maketotals(self, student_grades, grouped_assignments, course):
-        """Makes total grades."""
-        totals = []
-        totalweight = totalfrac = 0.0
-        for category in student_grades.keys():
-            cat = [category]
-            sgtot = catmax = 0
-            for sg, asgn in zip(student_grades[category],
-                                grouped_assignments[category]):
-                if sg is not None:
-                    sgtot += sum(sg['scores'])
-                catmax += sum(asgn['points'])
-            cat.append(sgtot)
-            cat.append(catmax)
-            weight = course['weights'][category]
-            cat.append(weight)
-            totalweight += weight
-            catfrac = sgtot / catmax
-            #cat.append(catfrac)
-            wfrac = catfrac * weight
-            cat.append(wfrac)
-            totalfrac += wfrac
-            totals.append(cat)
-        wtotal = totalfrac / totalweight
-        return sorted(totals), wtotal
-
-    def plot_letter_grades(self, students_kwargs, scale):
-        """Plots the letter grades in a historgram"""
+    def plot_letter_grades(self, letters, course_id):
+        """Plots the letter grades of a course, see
+        ``regolith.gradebook.LetterGrades``, in a historgram. Returns the base
+        name of the plot's files, or None if it could not be plotted.
+        """
         try:
             import matplotlib.pyplot as plt
         except ImportError:
-            return False
-        bins = [x[1] for x in scale[::-1]]
-        raws = []
-        curveds = []
-        for skw in students_kwargs.values():
-            raws.append(skw['student_letter_grade_raw'])
-            curveds.append(skw['student_letter_grade_curved'])
-        n = len(raws)
-        rfreq = [raws.count(l) for l in bins]
-        cfreq = [curveds.count(l) for l in bins]
+            return None
+        bins = letters.letters
+        rfreq = letters.raw_counts
+        cfreq = letters.curved_counts
         width = 1.0
         pos = np.arange(len(bins))
         f, (ax1, ax2) = plt.subplots(1, 2, sharey=True)
@@ -288,31 +223,34 @@ class GradeReportBuilder(object):
         ax2.set_xlabel('Curved Grade')
         ax2.bar(pos, cfreq, width, color='green')
         ax2.grid(True)
-        base = os.path.join(self.bldir, 'student-letter-grade-dist')
+        name = course_id + '-letter-grade-dist'
+        base = os.path.join(self.bldir, name)
         plt.savefig(base + '.png', bbox_inches='tight')
-        plt.savefig(base + '.eps', bbox_inches='tight')
-        return True
+        eps = io.BytesIO()
+        plt.savefig(eps, format='eps', bbox_inches='tight')
+        _write_if_changed(base + '.eps', eps.getvalue())
+        plt.close(f)
+        return name
+
 
+def _write_if_changed(filename, data):
+    """Writes EPS data to a file, unless the file already holds the same
+    data but for its creation date, so that the reports that include it are
+    only made again when it changes."""
+    def undated(d):
+        return re.sub(b'%%CreationDate:[^\n]*\n', b'', d)
+    try:
+        with open(filename, 'rb') as f:
+            if undated(f.read()) == undated(data):
+                return
+    except OSError:
+        pass
+    with open(filename, 'wb') as f:
+        f.write(data)
 
-DEFAULT_LETTER_SCALE = (
-    (0.97, "A+"),
-    (0.93, "A"),
-    (0.90, "A-"),
-    (0.87, "B+"),
-    (0.83, "B"),
-    (0.80, "B-"),
-    (0.77, "C+"),
-    (0.73, "C"),
-    (0.70, "C-"),
-    (0.67, "D+"),
-    (0.63, "D"),
-    (0.60, "D-"),
-    (-1.0, "F"),
-    )
 
 def find_letter_grade(score, scale=DEFAULT_LETTER_SCALE):
-    """Finds the letter grade from a score and a value."""
-    for lower, letter in scale:
-        if lower <= score:
-            return letter
-    return letter
+    """Finds the letter grade from a score and a value. To find the letter
+    grades of many scores, see ``regolith.gradebook.letter_grades()``.
+    """
+    return scale[letter_indices([score], scale)[0]][1]
@@ -1,11 +1,18 @@
 """
 Loads the dbs for interactive sessions
+
+Only the collections that were written to through the client, such as with
+``rc.client.update_one()``, are dumped back to the file system. Editing the
+documents in ``dbs`` directly does not mark their collections as changed, so
+call ``rc.client.mark_dirty(dbname, collname)`` after such edits, and then
+``regolith.database.dump_database(db, rc.client, rc)`` to write them.
 """
 from regolith.database import connect
 from regolith.main import DEFAULT_RC, load_rcfile, filter_databases
 
 rc = DEFAULT_RC
 rc._update(load_rcfile('regolithrc.json'))
+rc.digest_keys = frozenset(rc)
 filter_databases(rc)
 
 with connect(rc) as rc.client:
@@ -0,0 +1,85 @@
+"""Runs jobs, such as compiling a document, that are made of a sequence of
+external commands. Independent jobs run concurrently, while the steps of
+each job run in order. The output of each job is captured and only shown if
+the job fails, so that the output of concurrent jobs is not interleaved.
+"""
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+
+def run_job(steps, run):
+    """Runs the steps of a job in order, stopping at the first one that
+    fails.
+
+    Parameters
+    ----------
+    steps : list
+        Each step is either a command, which is passed to run, or a
+        function that takes a run function and may run several commands,
+        and that raises an exception if it fails.
+    run : callable
+        Runs a command and returns a ``subprocess.CompletedProcess`` with
+        the output in ``stdout``, raising ``CalledProcessError`` on failure.
+
+    Returns
+    -------
+    ok : bool
+        Whether all of the steps succeeded.
+    output : str
+        The output of all of the commands that were run.
+    """
+    output = []
+
+    def run_step(cmd):
+        try:
+            res = run(cmd)
+        except subprocess.CalledProcessError as e:
+            output.append(e.output or '')
+            raise
+        output.append(res.stdout or '')
+        return res
+
+    try:
+        for step in steps:
+            if callable(step):
+                step(run_step)
+            else:
+                run_step(step)
+    except Exception as e:
+        output.append(str(e) + '\n')
+        return False, ''.join(output)
+    return True, ''.join(output)
+
+
+def run_jobs(jobs, run, nprocs=1):
+    """Runs jobs on up to nprocs threads at once. The output of the jobs
+    that fail is printed to stderr, one job at a time.
+
+    Parameters
+    ----------
+    jobs : dict
+        Maps job names to their steps, see ``run_job()``.
+    run : callable
+        Runs a single command, see ``run_job()``.
+    nprocs : int, optional
+        The maximum number of jobs to run at once.
+
+    Returns
+    -------
+    failed : list of str
+        The names of the jobs that failed, in order.
+    """
+    names = list(jobs)
+    if nprocs > 1 and len(names) > 1:
+        with ThreadPoolExecutor(max_workers=nprocs) as executor:
+            results = list(executor.map(run_job, [jobs[n] for n in names],
+                                        [run] * len(names)))
+    else:
+        results = [run_job(jobs[n], run) for n in names]
+    failed = []
+    for name, (ok, output) in zip(names, results):
+        if not ok:
+            print('{0} failed:\n{1}'.format(name, output), file=sys.stderr)
+            failed.append(name)
+    return failed
@@ -0,0 +1,161 @@
+"""Compiles LaTeX documents with only as many passes as they need.
+
+Rather than always running latex, bibtex, latex, and latex, the compile
+step runs bibtex only when the citations or the bibliography database
+changed since the ``.bbl`` file was made, and reruns latex only until the
+``.aux`` file stops changing.
+
+Documents that are batches of several reports, such as the grade reports of
+a course, mark the page that each report starts on in their ``.aux`` file,
+so that their PDF can be split into a PDF for each report.
+"""
+import hashlib
+import os
+import re
+
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:
+    PdfReader = PdfWriter = None
+
+from regolith.tools import LATEX_OPTS
+
+MAX_PASSES = 5
+"""The most times latex is run on a document, in case it never settles."""
+
+BIB_DIGEST = '% regolith bibliography digest: '
+
+AUX_BIB_RE = re.compile(r'^\\(citation|bibdata|bibstyle)\{(.*)\}$')
+
+PAGE_MARK_RE = re.compile(r'^\\regolithpage\{(.*)\}\{(\d+)\}$')
+
+
+def _read(filename):
+    try:
+        with open(filename, 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def aux_state(auxfile):
+    """Returns the contents of an aux file that the next latex pass would
+    read. A missing aux file is the same as one that is only ``\\relax``.
+    """
+    aux = _read(auxfile) or b''
+    return b'\n'.join(line for line in aux.splitlines()
+                      if line.strip() != b'\\relax')
+
+
+def bib_digest(auxfile, builddir):
+    """Returns a digest of what bibtex would read for a document: its
+    citations, bibliography style, and bibliography databases. None means
+    that the document has no bibliography, so bibtex need not run.
+    """
+    aux = _read(auxfile)
+    if aux is None:
+        return None
+    entries = {'citation': set(), 'bibdata': set(), 'bibstyle': set()}
+    for line in aux.decode('utf-8', 'replace').splitlines():
+        m = AUX_BIB_RE.match(line.strip())
+        if m is not None:
+            entries[m.group(1)].update(m.group(2).split(','))
+    if not entries['citation'] or not entries['bibdata']:
+        return None
+    h = hashlib.sha1()
+    for kind in sorted(entries):
+        h.update('{0}:{1}\n'.format(kind, sorted(entries[kind])).encode())
+    for name in sorted(entries['bibdata']):
+        if not name.endswith('.bib'):
+            name += '.bib'
+        h.update(_read(os.path.join(builddir, name)) or b'')
+    return h.hexdigest()
+
+
+def stored_bib_digest(bblfile):
+    """Returns the digest that a bbl file was made from, if it is known."""
+    bbl = _read(bblfile)
+    if not bbl:
+        return None
+    last = bbl.rstrip().splitlines()[-1].decode('utf-8', 'replace')
+    if last.startswith(BIB_DIGEST):
+        return last[len(BIB_DIGEST):].strip()
+    return None
+
+
+def compile_latex(base, builddir, opts=LATEX_OPTS, max_passes=MAX_PASSES):
+    """Returns a job step, see ``regolith.jobs``, that compiles
+    ``base.tex`` in builddir to a dvi file.
+    """
+    latex = ['latex'] + opts + [base + '.tex']
+    auxfile = os.path.join(builddir, base + '.aux')
+    bblfile = os.path.join(builddir, base + '.bbl')
+
+    def step(run):
+        prev = aux_state(auxfile)
+        for i in range(max_passes):
+            run(latex)
+            state = aux_state(auxfile)
+            if i == 0:
+                digest = bib_digest(auxfile, builddir)
+                if digest is not None and \
+                        digest != stored_bib_digest(bblfile):
+                    run(['bibtex', base + '.aux'])
+                    with open(bblfile, 'a') as f:
+                        f.write(BIB_DIGEST + digest + '\n')
+                    # the next pass reads the new bbl, whatever the aux
+                    prev = state
+                    continue
+            if state == prev:
+                break
+            prev = state
+    return step
+
+
+def page_marks(auxfile):
+    """Returns a dict that maps the names of the page marks of a document to
+    the numbers of the pages that they are on. The ``\\regolithpagemark{name}``
+    macro of a template writes each mark to the aux file as a
+    ``\\regolithpage{name}{page}`` line, which is what is read here.
+    """
+    aux = _read(auxfile) or b''
+    marks = {}
+    for line in aux.decode('utf-8', 'replace').splitlines():
+        m = PAGE_MARK_RE.match(line.strip())
+        if m is not None:
+            marks[m.group(1)] = int(m.group(2))
+    return marks
+
+
+def split_pdf(base, builddir, names):
+    """Returns a job step, see ``regolith.jobs``, that splits ``base.pdf`` in
+    builddir into a PDF for each of names. The ith PDF holds the pages from
+    the page mark named ``i`` up to the next mark, and the last one up to the
+    mark named ``end``, see ``page_marks()``. The PDF is split with pypdf if
+    it is installed, or else with ghostscript.
+    """
+    def step(run):
+        marks = page_marks(os.path.join(builddir, base + '.aux'))
+        keys = [str(i) for i in range(len(names))] + ['end']
+        missing = [k for k in keys if k not in marks]
+        if missing:
+            raise ValueError('{0}.aux has no page marks named {1}'.format(
+                base, ', '.join(missing)))
+        pages = [marks[k] for k in keys]
+        ranges = [(name + '.pdf', first, last - 1) for name, first, last
+                  in zip(names, pages[:-1], pages[1:])]
+        if PdfReader is None:
+            for fname, first, last in ranges:
+                run(['gs', '-q', '-dNOPAUSE', '-dBATCH', '-dSAFER',
+                     '-sDEVICE=pdfwrite', '-dFirstPage={0}'.format(first),
+                     '-dLastPage={0}'.format(last), '-sOutputFile=' + fname,
+                     base + '.pdf'])
+            return
+        reader = PdfReader(os.path.join(builddir, base + '.pdf'))
+        for fname, first, last in ranges:
+            writer = PdfWriter()
+            for i in range(first - 1, last):
+                writer.add_page(reader.pages[i])
+            with open(os.path.join(builddir, fname), 'wb') as f:
+                writer.write(f)
+    return step
@@ -16,6 +16,10 @@ DEFAULT_RC = RunControl(
     _validators=DEFAULT_VALIDATORS,
     backend='filesystem',
     builddir='_build',
+    nprocs=1,
+    cache=True,
+    materialize=False,
+    batch_grades=False,
     mongodbpath=property(lambda self: os.path.join(self.builddir, '_dbpath')),
     )
 
@@ -60,6 +64,9 @@ def load_rcfile(fname):
 
 def create_parser():
     p = ArgumentParser()
+    p.add_argument('--no-cache', dest='cache', action='store_false',
+                   default=NotSpecified,
+                   help='do not use the cache of parsed collections')
     subp = p.add_subparsers(title='cmd', dest='cmd')
 
     # rc subparser
@@ -112,6 +119,13 @@ def create_parser():
     bldp.add_argument('build_targets', nargs='+',
                       help='targets to build. Currently valid targets are: \n{}'.
                       format([k for k in BUILDERS]))
+    bldp.add_argument('--force', dest='force', action='store_true',
+                      default=False,
+                      help='builds all outputs, even those whose inputs have '
+                           'not changed since the last build')
+    bldp.add_argument('--explain', dest='explain', action='store_true',
+                      default=False,
+                      help='prints why each output is built or up to date')
 
     # deploy subparser
     depp = subp.add_parser('deploy', help='deploys what was built by regolith')
@@ -174,13 +188,15 @@ def main(args=None):
     ns = parser.parse_args(args)
     if ns.cmd in NEED_RC:
         rc._update(load_rcfile('regolithrc.json'))
+    # only these keys can change what is built, see basebuilder.rc_digest()
+    rc.digest_keys = frozenset(rc)
     rc._update(ns.__dict__)
     if ns.cmd in NEED_RC:
         filter_databases(rc)
     if rc.cmd in DISCONNECTED_COMMANDS:
         DISCONNECTED_COMMANDS[rc.cmd](rc)
     else:
-        with connect(rc) as rc.client:
+        with connect(rc, colls=commands.needed_colls(rc)) as rc.client:
             CONNECTED_COMMANDS[rc.cmd](rc)
 
 
@@ -0,0 +1,135 @@
+"""Records what each output of a build was made from, so that outputs whose
+inputs have not changed need not be built again.
+
+The manifest lives in ``${builddir}/_manifest.json`` and maps each builder
+type to the output files that it rendered, relative to its build directory,
+and to the digest of their inputs. Document ids, which need not be strings,
+are written with ``encode_id()`` so that they read back as the same type.
+"""
+import datetime
+import hashlib
+import json
+import os
+from collections.abc import Mapping, Set
+
+from jinja2 import meta
+
+MANIFEST = '_manifest.json'
+
+
+def _sort_key(obj):
+    return (type(obj).__name__, repr(obj))
+
+
+def _canonical(obj):
+    """Returns a JSON value that stands for obj. Mappings, whose keys need
+    not be strings or of one type, become ``{'m': [[key, value], ...]}``
+    with the keys as ``[type name, repr]`` pairs, sorted; sets become sorted
+    lists; dates and times become ISO strings; and NumPy arrays and scalars
+    become lists and numbers. Other objects raise a TypeError, since their
+    reprs may hold memory addresses that change from run to run.
+    """
+    if obj is None or isinstance(obj, (str, int, float)):
+        return obj
+    elif isinstance(obj, Mapping):
+        items = sorted(((_sort_key(k), v) for k, v in obj.items()),
+                       key=lambda item: item[0])
+        return {'m': [[list(k), _canonical(v)] for k, v in items]}
+    elif isinstance(obj, (list, tuple)):
+        return [_canonical(x) for x in obj]
+    elif isinstance(obj, Set):
+        return [_canonical(x) for x in sorted(obj, key=_sort_key)]
+    elif isinstance(obj, (datetime.date, datetime.time)):
+        return obj.isoformat()
+    elif hasattr(obj, 'tolist') and hasattr(obj, 'dtype'):
+        return _canonical(obj.tolist())
+    raise TypeError('cannot digest object of type ' + type(obj).__name__)
+
+
+def digest(obj):
+    """Returns a hex digest of a JSON-like object. Mappings, including
+    chained documents, and sets are digested by their contents, whatever
+    the types of their keys. A TypeError is raised if obj holds an object
+    that cannot be digested, see ``_canonical()``.
+    """
+    s = json.dumps(_canonical(obj), separators=(',', ':'))
+    return hashlib.sha1(s.encode('utf-8')).hexdigest()
+
+
+def encode_id(docid):
+    """Returns a document id as a JSON value that ``decode_id()`` turns back
+    into the same id, keeping the types of ids such as ``2019`` or
+    ``2017-01-01`` in YAML, which are ints and dates.
+    """
+    if isinstance(docid, datetime.datetime):
+        return {'datetime': docid.isoformat()}
+    elif isinstance(docid, datetime.date):
+        return {'date': docid.isoformat()}
+    elif isinstance(docid, (str, int, float, bool)) or docid is None:
+        return docid
+    return {'repr': repr(docid)}
+
+
+def decode_id(value):
+    """Returns the document id that ``encode_id()`` turned into value."""
+    if not isinstance(value, dict):
+        return value
+    elif 'datetime' in value:
+        return datetime.datetime.fromisoformat(value['datetime'])
+    elif 'date' in value:
+        return datetime.date.fromisoformat(value['date'])
+    return value['repr']
+
+
+def template_digest(env, name, _seen=None):
+    """Returns a hex digest of the source of a template and of all of the
+    templates that it extends, includes, or imports.
+    """
+    seen = set() if _seen is None else _seen
+    seen.add(name)
+    source, filename, _ = env.loader.get_source(env, name)
+    h = hashlib.sha1(source.encode('utf-8'))
+    refs = meta.find_referenced_templates(env.parse(source))
+    for ref in sorted(refs, key=str):
+        if ref is None:
+            # computed template names cannot be followed
+            h.update(b'dynamic')
+        elif ref not in seen:
+            h.update(template_digest(env, ref, seen).encode())
+    return h.hexdigest()
+
+
+class Manifest(object):
+    """The input digests of the outputs of previous builds."""
+
+    def __init__(self, builddir):
+        self.filename = os.path.join(builddir, MANIFEST)
+        try:
+            with open(self.filename) as f:
+                self.outputs = json.load(f)
+        except (OSError, ValueError):
+            self.outputs = {}
+
+    def get(self, btype, fname):
+        """Returns the input digest of an output, or None if unknown."""
+        return self.outputs.get(btype, {}).get(fname, None)
+
+    def set(self, btype, fname, value):
+        """Records the input digest of an output."""
+        self.outputs.setdefault(btype, {})[fname] = value
+
+    def remove(self, btype, fname):
+        """Forgets an output, so that it is built again next time."""
+        self.outputs.get(btype, {}).pop(fname, None)
+
+    def files(self, btype):
+        """Returns the outputs that are known for a builder type."""
+        return set(self.outputs.get(btype, {}))
+
+    def save(self):
+        """Writes the manifest to the build directory."""
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.outputs, f, sort_keys=True, indent=1)
+        os.replace(tmp, self.filename)
@@ -17,6 +17,8 @@ try:
 except ImportError:
     MONGO_AVAILABLE = False
 
+from regolith.query import Cursor
+from regolith.tracking import record
 from regolith.tools import dbdirname, dbpathname, fallback
 
 
@@ -38,6 +40,17 @@ class InsertOneProxy(object):
         self.acknowledged = acknowledged
 
 
+def upsert_update(doc):
+    """Returns the update that upserts a document by its ``_id``. The server
+    rejects an empty ``$set``, so a document with nothing but an ``_id`` is
+    only inserted if it is missing.
+    """
+    update = {k: v for k, v in doc.items() if k != '_id'}
+    if len(update) == 0:
+        return {'$setOnInsert': {'_id': doc['_id']}}
+    return {'$set': update}
+
+
 class MongoClient:
     """A client backed by MongoDB."""
 
@@ -143,10 +156,52 @@ class MongoClient:
         """Returns the collection names for the database name."""
         return self.client[dbname].collection_names()
 
+    def prefetch(self, collnames):
+        """Does nothing, since the server loads collections itself. This
+        keeps the interface of ``fsclient.FileSystemClient``.
+        """
+
+    def wait(self):
+        """Does nothing, since nothing is prefetched."""
+
     def all_documents(self, dbname, collname):
         """Returns an iterable over all documents in a collection."""
+        record(collname)
         return self.client[dbname][collname].find()
 
+    def find(self, dbname, collname, filter=None, projection=None, sort=None,
+             limit=None):
+        """Returns a cursor over the documents of a collection that match a
+        filter. If dbname is None, the collection is searched in all
+        databases, with the documents merged by ``_id`` as in ``chained_db``,
+        and filtering, sorting, and limiting happen client side.
+        """
+        record(collname)
+        if dbname is None:
+            return Cursor(self._chained_docs(collname), filter=filter,
+                          projection=projection, sort=sort, limit=limit)
+        cursor = self.client[dbname][collname].find(filter, projection)
+        if sort:
+            cursor = cursor.sort([(sort, 1)] if isinstance(sort, str)
+                                 else sort)
+        if limit:
+            cursor = cursor.limit(limit)
+        return cursor
+
+    def _chained_docs(self, collname):
+        """Yields the documents of a collection merged across databases by
+        ``_id``. Earlier databases take precedence field by field, as in
+        ``regolith.database.ChainedCollections``.
+        """
+        dbnames = getattr(getattr(self, 'chained_db', None), 'dbnames', None)
+        if dbnames is None:
+            dbnames = self.keys()
+        merged = {}
+        for name in reversed(list(dbnames)):
+            for doc in self.client[name][collname].find():
+                merged.setdefault(doc['_id'], {}).update(doc)
+        yield from merged.values()
+
     def insert_one(self, dbname, collname, doc):
         """Inserts one document to a database/collection."""
         coll = self.client[dbname][collname]
@@ -186,3 +241,31 @@ class MongoClient:
             return coll.update(doc, update, **kwargs)
         else:
             return coll.find_one_and_update(filter, update, **kwargs)
+
+    def bulk_upsert(self, dbname, collname, docs, batchsize=1000):
+        """Upserts many documents by their ``_id``, sending them to the
+        server as unordered bulk writes of batchsize operations each.
+        Returns the list of bulk write results.
+        """
+        coll = self.client[dbname][collname]
+        results = []
+        batch = []
+        for doc in docs:
+            batch.append(doc)
+            if len(batch) == batchsize:
+                results.append(self._bulk_upsert_batch(coll, batch))
+                batch = []
+        if len(batch) > 0:
+            results.append(self._bulk_upsert_batch(coll, batch))
+        return results
+
+    def _bulk_upsert_batch(self, coll, docs):
+        if ON_PYMONGO_V2:
+            bulk = coll.initialize_unordered_bulk_op()
+            for doc in docs:
+                bulk.find({'_id': doc['_id']}).upsert().update_one(
+                    upsert_update(doc))
+            return bulk.execute()
+        requests = [pymongo.UpdateOne({'_id': doc['_id']}, upsert_update(doc),
+                                      upsert=True) for doc in docs]
+        return coll.bulk_write(requests, ordered=False)
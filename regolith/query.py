@@ -0,0 +1,202 @@
+"""A subset of the MongoDB query language, for clients that hold their
+documents in memory.
+
+Filters map (possibly dotted) keys to either a value, which matches equal
+values and lists that contain the value, or to a dict of operators. The
+supported operators are ``$eq``, ``$ne``, ``$in``, ``$nin``, ``$gt``,
+``$gte``, ``$lt``, ``$lte``, and ``$exists``. As in MongoDB, null matches
+missing fields, and sorting orders values of different types by type.
+"""
+import datetime
+import operator
+from collections.abc import Mapping
+from itertools import islice
+
+
+def _raw_values(doc, key):
+    """Returns the values of a possibly dotted key in a document, looking
+    into lists along the way but not at the end.
+    """
+    values = [doc]
+    for part in key.split('.'):
+        found = []
+        for value in values:
+            if isinstance(value, list):
+                value = [v for v in value if isinstance(v, Mapping)]
+            else:
+                value = [value]
+            for v in value:
+                if isinstance(v, Mapping) and part in v:
+                    found.append(v[part])
+        values = found
+    return values
+
+
+def field_values(doc, key):
+    """Yields the values of a possibly dotted key in a document. Lists are
+    looked into, both along the way and at the end, like the multikey
+    indexes of MongoDB. For example, ``'team.name'`` yields the name of every
+    member of a document's team.
+    """
+    for value in _raw_values(doc, key):
+        if isinstance(value, list):
+            yield from value
+        else:
+            yield value
+
+
+def _equals(values, target):
+    if target is None and len(values) == 0:
+        # null matches missing fields too, like in MongoDB
+        return True
+    for value in values:
+        if value == target:
+            return True
+        elif isinstance(value, list) and target in value:
+            return True
+    return False
+
+
+def _compare(op):
+    def cmp(values, target):
+        for value in values:
+            for v in (value if isinstance(value, list) else [value]):
+                try:
+                    if op(v, target):
+                        return True
+                except TypeError:
+                    pass
+        return False
+    return cmp
+
+
+OPERATORS = {
+    '$eq': _equals,
+    '$ne': lambda values, target: not _equals(values, target),
+    '$in': lambda values, targets: any(_equals(values, t) for t in targets),
+    '$nin': lambda values, targets: not any(_equals(values, t)
+                                            for t in targets),
+    '$gt': _compare(operator.gt),
+    '$gte': _compare(operator.ge),
+    '$lt': _compare(operator.lt),
+    '$lte': _compare(operator.le),
+    '$exists': lambda values, target: (len(values) > 0) == bool(target),
+    }
+
+
+def is_operator(cond):
+    """Tests if a filter condition is a dict of operators."""
+    return (isinstance(cond, Mapping) and len(cond) > 0 and
+            all(k.startswith('$') for k in cond))
+
+
+def match(doc, filter):
+    """Tests if a document matches a filter."""
+    for key, cond in filter.items():
+        values = _raw_values(doc, key)
+        if is_operator(cond):
+            for op, target in cond.items():
+                if op not in OPERATORS:
+                    raise ValueError('query operator {0!r} is not '
+                                     'supported'.format(op))
+                if not OPERATORS[op](values, target):
+                    return False
+        elif not _equals(values, cond):
+            return False
+    return True
+
+
+def project(doc, projection):
+    """Applies a projection to a document, returning a new dict. Projections
+    either include the keys that map to true values (and ``_id``, unless it
+    is excluded) or exclude the keys that map to false values.
+    """
+    if projection is None:
+        return doc
+    include = {k for k, v in projection.items() if v}
+    if include:
+        if projection.get('_id', True):
+            include.add('_id')
+        return {k: doc[k] for k in include if k in doc}
+    exclude = {k for k, v in projection.items() if not v}
+    return {k: v for k, v in doc.items() if k not in exclude}
+
+
+def _order(value):
+    """Returns a key that orders values of any types, first by type, in the
+    order that MongoDB compares BSON types, then by value. Null and missing
+    values sort first.
+    """
+    if value is None:
+        return (0,)
+    elif isinstance(value, bool):
+        return (5, value)
+    elif isinstance(value, (int, float)):
+        return (1, value)
+    elif isinstance(value, str):
+        return (2, value)
+    elif isinstance(value, Mapping):
+        return (3, tuple((k, _order(v)) for k, v in value.items()))
+    elif isinstance(value, (list, tuple)):
+        return (4, tuple(_order(v) for v in value))
+    elif isinstance(value, datetime.datetime):
+        return (6, value.replace(tzinfo=None))
+    elif isinstance(value, datetime.date):
+        return (6, datetime.datetime(value.year, value.month, value.day))
+    return (7, type(value).__name__, repr(value))
+
+
+def _sort_key(key):
+    def keyfunc(doc):
+        values = _raw_values(doc, key)
+        return _order(values[0] if len(values) > 0 else None)
+    return keyfunc
+
+
+def sort_docs(docs, sort):
+    """Sorts documents by a key name or a list of (key, direction) pairs,
+    where direction is 1 for ascending or -1 for descending order.
+    """
+    if isinstance(sort, str):
+        sort = [(sort, 1)]
+    docs = list(docs)
+    for key, direction in reversed(sort):
+        docs.sort(key=_sort_key(key), reverse=(direction < 0))
+    return docs
+
+
+class Cursor(object):
+    """A lazy cursor over the documents that match a filter. Like the
+    cursors of pymongo, ``sort()`` and ``limit()`` may be chained onto it
+    before it is iterated over.
+    """
+
+    def __init__(self, docs, filter=None, projection=None, sort=None,
+                 limit=None):
+        self._docs = docs
+        self._filter = filter or {}
+        self._projection = projection
+        self._sort = sort
+        self._limit = limit
+
+    def sort(self, key, direction=1):
+        """Sorts by a key, or by a list of (key, direction) pairs."""
+        self._sort = key if isinstance(key, list) else [(key, direction)]
+        return self
+
+    def limit(self, limit):
+        """Limits the number of documents returned, 0 means no limit."""
+        self._limit = limit
+        return self
+
+    def __iter__(self):
+        docs = self._docs
+        if self._filter:
+            docs = (doc for doc in docs if match(doc, self._filter))
+        if self._sort:
+            docs = sort_docs(docs, self._sort)
+        if self._limit:
+            docs = islice(docs, self._limit)
+        if self._projection is not None:
+            docs = (project(doc, self._projection) for doc in docs)
+        return iter(docs)
@@ -0,0 +1,88 @@
+"""JSON serialization for collection files, with optional fast backends.
+
+Decoding uses the first of orjson, ujson, and the standard library json
+module that is installed, unless the ``json_backend`` run control key picks
+one of them. Encoding always goes through the standard library, since neither fast encoder can reproduce its
+``sort_keys=True`` output byte for byte (separators, ``ensure_ascii``
+escapes, and NaN handling all differ), and database repos should not churn.
+
+The fast decoders cannot hold integers wider than 64 bits (orjson silently
+turns them into floats), so files that may have such integers are decoded
+with the standard library instead, and dumping them again does not change
+them. This is what makes it safe to pick a fast decoder by default.
+"""
+import json
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+# the backends that are installed, fastest first
+BACKENDS = ['json']
+if ujson is not None:
+    BACKENDS.insert(0, 'ujson')
+if orjson is not None:
+    BACKENDS.insert(0, 'orjson')
+
+_ENCODER = json.JSONEncoder(sort_keys=True)
+# every integer of 18 digits or fewer fits in 64 bits
+_WIDE_INT = re.compile('[0-9]{19}')
+_loads = None
+BACKEND = None
+
+
+def _orjson_loads(s):
+    if _WIDE_INT.search(s) is not None:
+        return json.loads(s)
+    try:
+        return orjson.loads(s)
+    except orjson.JSONDecodeError:
+        # orjson is stricter than json, eg. about NaN and Infinity
+        return json.loads(s)
+
+
+def _ujson_loads(s):
+    if _WIDE_INT.search(s) is not None:
+        return json.loads(s)
+    try:
+        return ujson.loads(s)
+    except ValueError:
+        return json.loads(s)
+
+
+_LOADERS = {
+    'orjson': _orjson_loads,
+    'ujson': _ujson_loads,
+    'json': json.loads,
+    }
+
+
+def set_backend(name):
+    """Sets the JSON decoding backend, one of the names in BACKENDS, which
+    defaults to the first of them."""
+    global BACKEND, _loads
+    if name not in BACKENDS:
+        raise ValueError('JSON backend {0!r} is not available, valid '
+                         'backends are {1}'.format(name, BACKENDS))
+    BACKEND = name
+    _loads = _LOADERS[name]
+
+
+def loads(s):
+    """Decodes a JSON string with the current backend."""
+    return _loads(s)
+
+
+def dumps(doc):
+    """Encodes a document as JSON with sorted keys."""
+    return _ENCODER.encode(doc)
+
+
+set_backend(BACKENDS[0])
@@ -4,6 +4,7 @@ import email.utils
 import os
 import platform
 import sys
+from collections import ChainMap
 from copy import deepcopy
 
 from datetime import datetime
@@ -67,6 +68,14 @@ def all_docs_from_collection(client, collname):
     yield from client.all_documents(collname)
 
 
+def find_docs_from_collection(client, collname, filter=None, **kwargs):
+    """Yield the entries of all collections of a given name that match a
+    filter, see ``regolith.query``. The keyword arguments (projection, sort,
+    and limit) are passed on to the client's ``find()``.
+    """
+    yield from client.find(None, collname, filter, **kwargs)
+
+
 SHORT_MONTH_NAMES = (None, 'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul',
                      'Aug', 'Sept', 'Oct', 'Nov', 'Dec')
 
@@ -99,6 +108,14 @@ def month_and_year(m=None, y=None):
     return '{0} {1}'.format(SHORT_MONTH_NAMES[m], y)
 
 
+def overlay_doc(doc, **fields):
+    """Returns a copy-on-write view of a document, in which the given fields
+    replace those of the document. The rest of the document is shared rather
+    than copied, and writes to the view never reach the document.
+    """
+    return ChainMap(fields, doc)
+
+
 def filter_publications(citations, authors, reverse=False, bold=True):
     """Filter publications by the author(s)
 
@@ -112,12 +129,14 @@ def filter_publications(citations, authors, reverse=False, bold=True):
         If True reverse the order, defaults to False
     bold : bool, optional
         If True put latex bold around the author(s) in question
+
+    The publications are shared with the citations, with the bolded authors
+    overlaid on top, see ``overlay_doc()``, so they are only for rendering.
     """
     pubs = []
     for pub in citations:
         if len(set(pub['author']) & authors) == 0:
             continue
-        pub = deepcopy(pub)
         if bold:
             bold_self = []
             for a in pub['author']:
@@ -125,9 +144,7 @@ def filter_publications(citations, authors, reverse=False, bold=True):
                     bold_self.append('\\textbf{' + a + '}')
                 else:
                     bold_self.append(a)
-            pub['author'] = bold_self
-        else:
-            pub = deepcopy(pub)
+            pub = overlay_doc(pub, author=bold_self)
         pubs.append(pub)
     pubs.sort(key=doc_date_key, reverse=reverse)
     return pubs
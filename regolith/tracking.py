@@ -0,0 +1,107 @@
+"""Tracks which collections and documents are read while rendering, so that
+builds know what each output depends on.
+
+Reads are recorded inside of a ``track()`` block, per thread. Chained
+documents record reads of themselves, lists of whole collections record
+reads of the collection, and so do the clients' ``all_documents()`` and
+``find()``. Builders record reads of the files that an output includes,
+such as plots, as reads of the ``FILES`` collection whose ids are the paths
+of the files. Outside of a ``track()`` block, nothing is recorded.
+"""
+import contextvars
+from collections import ChainMap
+from contextlib import contextmanager
+
+ALL = '*'
+"""The document id that stands for a whole collection."""
+
+FILES = '_files'
+"""The collection name that stands for the files of a build."""
+
+_reads = contextvars.ContextVar('regolith_reads', default=None)
+
+
+def record(collname, docid=ALL):
+    """Records a read of a document, or of a whole collection."""
+    reads = _reads.get()
+    if reads is not None:
+        reads.add((collname, docid))
+
+
+@contextmanager
+def track():
+    """Context manager that yields the set of the (collection name,
+    document id) pairs that are read inside of it.
+    """
+    reads = set()
+    token = _reads.set(reads)
+    try:
+        yield reads
+    finally:
+        _reads.reset(token)
+
+
+def graph(reads):
+    """Turns a set of reads into a dict that maps collection names to the
+    sorted ids of the documents that were read, or to ``[ALL]``.
+    """
+    g = {}
+    for collname, docid in reads:
+        g.setdefault(collname, set()).add(docid)
+    return {collname: [ALL] if ALL in ids else sorted(ids, key=str)
+            for collname, ids in g.items()}
+
+
+class TrackedDocument(ChainMap):
+    """A chained document that records when it is read."""
+    collname = None
+    docid = None
+
+    def _record(self):
+        record(self.collname, self.docid)
+
+    def __getitem__(self, key):
+        self._record()
+        return super().__getitem__(key)
+
+    def __contains__(self, key):
+        self._record()
+        return super().__contains__(key)
+
+    def __iter__(self):
+        self._record()
+        return super().__iter__()
+
+    def __len__(self):
+        self._record()
+        return super().__len__()
+
+    def get(self, key, default=None):
+        self._record()
+        return super().get(key, default)
+
+
+class TrackedList(list):
+    """A list of the documents of a collection, which records a read of
+    the whole collection when it is used.
+    """
+
+    def __init__(self, collname, docs=()):
+        super().__init__(docs)
+        self.collname = collname
+
+    def __iter__(self):
+        record(self.collname)
+        return super().__iter__()
+
+    def __getitem__(self, index):
+        record(self.collname)
+        return super().__getitem__(index)
+
+    def __len__(self):
+        record(self.collname)
+        return super().__len__()
+
+    def __contains__(self, doc):
+        record(self.collname)
+        return super().__contains__(doc)
@@ -108,6 +108,12 @@ def ensure_email(email):
 DEFAULT_VALIDATORS = {
     'backend': (is_string, ensure_string),
     'builddir': (is_string, ensure_string),
+    'nprocs': (is_int, int),
+    'cache': (is_bool, to_bool),
+    'cache_size': (is_int, int),
+    'json_backend': (is_string, ensure_string),
+    'materialize': (is_bool, to_bool),
+    'batch_grades': (is_bool, to_bool),
     'databases': (always_false, ensure_databases),
     'stores': (always_false, ensure_stores),
     'email': (always_false, ensure_email),
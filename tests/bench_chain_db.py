@@ -0,0 +1,56 @@
+"""Benchmarks lookups through ChainDB and CachingChainDB on deep chains of
+several databases. Run with ``python -m tests.bench_chain_db`` from the
+repository root, optionally giving the number of lookups, databases, and
+levels.
+"""
+import gc
+import sys
+import time
+
+from regolith.chained_db import ChainDB, CachingChainDB
+
+N = 100000
+
+
+def bench(f, *args):
+    # like timeit, keep the garbage collector out of the measurement
+    gc.collect()
+    gc.disable()
+    try:
+        t0 = time.perf_counter()
+        f(*args)
+        return time.perf_counter() - t0
+    finally:
+        gc.enable()
+
+
+def make_maps(ndbs, depth):
+    maps = []
+    for i in range(ndbs):
+        m = {'leaf{0}'.format(i): i, 'leaf': i}
+        for level in range(depth):
+            m = {'k': m, 'other{0}'.format(level): level}
+        maps.append(m)
+    return maps
+
+
+def lookup(z, depth, n):
+    for _ in range(n):
+        v = z
+        for _ in range(depth):
+            v = v['k']
+        v['leaf']
+
+
+def main(n=N, ndbs=3, depth=5):
+    maps = make_maps(ndbs, depth)
+    print('{0} lookups, {1} databases, {2} levels deep'.format(
+        n, ndbs, depth))
+    for cls in (ChainDB, CachingChainDB):
+        t = bench(lookup, cls(*maps), depth, n)
+        print('{0}: {1:.3f} s, {2:,.0f} lookups/s'.format(
+            cls.__name__, t, n / t))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,56 @@
+"""Benchmarks the JSON backends on the schema exemplars, scaled up to a
+collection of 100k documents. Run with
+``python -m tests.bench_json_backends`` from the repository root.
+"""
+import gc
+import json
+import sys
+import time
+from itertools import cycle, islice
+
+from regolith import serializers
+from regolith.schemas import EXEMPLARS
+
+N = 100000
+
+
+def make_lines(n=N):
+    lines = []
+    for i, (collname, doc) in enumerate(islice(cycle(sorted(EXEMPLARS.items())), n)):
+        doc = dict(doc)
+        doc['_id'] = '{0}-{1}'.format(collname, i)
+        lines.append(serializers.dumps(doc))
+    return lines
+
+
+def bench(f, *args):
+    # like timeit, keep the garbage collector out of the measurement
+    gc.collect()
+    gc.disable()
+    try:
+        t0 = time.perf_counter()
+        f(*args)
+        return time.perf_counter() - t0
+    finally:
+        gc.enable()
+
+
+def main(n=N):
+    lines = make_lines(n)
+    docs = [json.loads(line) for line in lines]
+    batch = '[' + ','.join(lines) + ']'
+    print('{0} documents, {1:.1f} MB'.format(
+        n, sum(map(len, lines)) / 2**20))
+    print('encode, stdlib json: {0:.3f} s'.format(
+        bench(lambda: [serializers.dumps(doc) for doc in docs])))
+    for backend in serializers.BACKENDS:
+        serializers.set_backend(backend)
+        per_line = bench(lambda: [serializers.loads(line) for line in lines])
+        batched = bench(serializers.loads, batch)
+        assert serializers.loads(batch) == docs
+        print('decode, {0}: {1:.3f} s per line, {2:.3f} s batched'.format(
+            backend, per_line, batched))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
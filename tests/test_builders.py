@@ -0,0 +1,340 @@
+import datetime
+import os
+import sys
+import threading
+from types import SimpleNamespace
+
+import pytest
+from jinja2 import DictLoader, Environment
+
+from regolith.basebuilder import BuilderBase, make_env, precompile, \
+    rc_digest, write_stream
+from regolith.database import ChainedCollections
+from regolith.fsclient import FileSystemClient
+from regolith.manifest import digest
+from regolith.tracking import ALL, TrackedList
+
+
+class PeopleBuilder(BuilderBase):
+    btype = 'people'
+
+    def __init__(self, rc):
+        super().__init__(rc)
+        self.cmds = ['people']
+        self.built = {}
+
+    def construct_global_ctx(self):
+        super().construct_global_ctx()
+        self.gtx['people'] = [{'_id': str(i)} for i in range(8)]
+
+    def people(self):
+        self.for_each_person(self.person)
+
+    def person(self, p):
+        if p['_id'] == '3':
+            raise ValueError('bad person')
+        self.built[p['_id']] = threading.current_thread().name
+
+
+@pytest.mark.parametrize('nprocs', [1, 4])
+def test_for_each_person(tmpdir, capsys, nprocs):
+    rc = SimpleNamespace(builddir=str(tmpdir), nprocs=nprocs)
+    b = PeopleBuilder(rc)
+    with pytest.raises(RuntimeError, match='could not build people for: 3'):
+        b.build()
+    assert sorted(b.built) == ['0', '1', '2', '4', '5', '6', '7']
+    assert b.failed == {'3'}
+    assert 'bad person' in capsys.readouterr().err
+    threads = set(b.built.values())
+    assert (threading.current_thread().name in threads) is (nprocs == 1)
+
+
+class PagesBuilder(BuilderBase):
+    btype = 'pages'
+    derived_exts = ('.bib',)
+
+    def __init__(self, rc, pages, templates):
+        self.texts = pages
+        super().__init__(rc)
+        self.env = Environment(loader=DictLoader(templates))
+        self.cmds = ['pages']
+
+    def pages(self):
+        for name, text in self.texts.items():
+            self.render('page.txt', name + '.txt', text=text)
+
+
+def test_incremental_build(tmpdir):
+    rc = SimpleNamespace(builddir=str(tmpdir))
+    templates = {'page.txt': '{% include "inc.txt" %}{{ text }}',
+                 'inc.txt': '> '}
+    pages = {'a': 'A', 'b': 'B'}
+    b = PagesBuilder(rc, pages, templates)
+    b.build()
+    assert b.rendered == {'a.txt', 'b.txt'}
+    assert tmpdir.join('pages', 'a.txt').read() == '> A'
+    # nothing changed
+    b = PagesBuilder(rc, pages, templates)
+    b.build()
+    assert b.rendered == set()
+    # a page changed, and another one was deleted
+    tmpdir.join('pages', 'b.bib').write('')
+    b = PagesBuilder(rc, {'a': 'AA'}, templates)
+    b.build()
+    assert b.rendered == {'a.txt'}
+    assert sorted(f.basename for f in tmpdir.join('pages').listdir()) == \
+        ['a.txt']
+    # an included template changed
+    templates['inc.txt'] = '>> '
+    b = PagesBuilder(rc, {'a': 'AA'}, templates)
+    b.build()
+    assert tmpdir.join('pages', 'a.txt').read() == '>> AA'
+    # the run control changed, in ways that templates may or may not see
+    rc.nprocs = 2
+    b = PagesBuilder(rc, {'a': 'AA'}, templates)
+    b.build()
+    assert b.rendered == set()
+    rc.cmd, rc.build_targets = 'build', ['pages', 'cv']
+    b = PagesBuilder(rc, {'a': 'AA'}, templates)
+    b.build()
+    assert b.rendered == set()
+    rc.build_targets = ['pages']
+    b = PagesBuilder(rc, {'a': 'AA'}, templates)
+    b.build()
+    assert b.rendered == set()
+    rc.groupname = 'Group'
+    b = PagesBuilder(rc, {'a': 'AA'}, templates)
+    b.build()
+    assert b.rendered == {'a.txt'}
+    # forced
+    rc.force = True
+    b = PagesBuilder(rc, {'a': 'AA'}, templates)
+    b.build()
+    assert b.rendered == {'a.txt'}
+
+
+def test_rc_digest_config_keys():
+    rc = SimpleNamespace(groupname='Group', build_targets=['html'], db='a')
+    d = rc_digest(rc)
+    rc.build_targets = ['html', 'cv']
+    assert rc_digest(rc) == d
+    rc.db = 'b'
+    assert rc_digest(rc) != d
+    # keys from the command line are left out
+    rc.digest_keys = frozenset(['groupname'])
+    d = rc_digest(rc)
+    rc.db = 'c'
+    assert rc_digest(rc) == d
+    rc.groupname = 'Other'
+    assert rc_digest(rc) != d
+    assert rc_digest(rc, keys=['db']) == rc_digest(SimpleNamespace(db='c'))
+
+
+def test_digest_keys():
+    assert digest({1: 'x', 2: 'y'}) == digest({2: 'y', 1: 'x'})
+    assert digest({1: 'x'}) != digest({'1': 'x'})
+    assert digest({1: 'x', 'b': 2}) == digest({'b': 2, 1: 'x'})
+    day = datetime.date(2020, 1, 1)
+    assert digest({day: 'x'}) == digest({datetime.date(2020, 1, 1): 'x'})
+    assert digest({day: 'x'}) != digest({'2020-01-01': 'x'})
+    assert digest({'a': {3, 'b'}}) == digest({'a': {'b', 3}})
+    assert digest({}) != digest([])
+
+
+def test_undigestible_args(tmpdir):
+    rc = SimpleNamespace(builddir=str(tmpdir))
+    with pytest.raises(TypeError):
+        digest({'a': object()})
+    b = PagesBuilder(rc, {'a': object()}, {'page.txt': 'A'})
+    b.build()
+    assert b.rendered == {'a.txt'}
+    # always rendered, rather than compared by memory address
+    b = PagesBuilder(rc, {'a': object()}, {'page.txt': 'A'})
+    b.build()
+    assert b.rendered == {'a.txt'}
+
+
+class CompiledBuilder(PagesBuilder):
+    btype = 'compiled'
+
+    def __init__(self, rc, pages):
+        super().__init__(rc, pages, {'page.txt': '{{ text }}'})
+        self.cmds = ['pages', 'compile']
+
+    def compile(self):
+        code = 'import sys; sys.exit({0})'
+        self.run_jobs({name: [[sys.executable, '-c', code.format(int(bad))]]
+                       for name, bad in self.texts.items()})
+
+
+def test_failed_jobs_fail_build(tmpdir, capsys):
+    rc = SimpleNamespace(builddir=str(tmpdir), nprocs=2)
+    b = CompiledBuilder(rc, {'a': True, 'b': False})
+    with pytest.raises(RuntimeError, match='could not build compiled for: a$'):
+        b.build()
+    assert 'a failed' in capsys.readouterr().err
+    CompiledBuilder(rc, {'a': False, 'b': False}).build()
+
+
+class ProfilesBuilder(PagesBuilder):
+    btype = 'profiles'
+
+    def __init__(self, rc):
+        super().__init__(rc, {}, {
+            'profile.txt': '{{ p.name }} ({{ people|length }} people)',
+            'bio.txt': '{{ rc.client.chained_db.people.bob.bio }}',
+            })
+        self.cmds = ['profiles']
+
+    def construct_global_ctx(self):
+        super().construct_global_ctx()
+        self.gtx['people'] = TrackedList('people', sorted(
+            self.rc.client.all_documents('people'), key=lambda p: p['_id']))
+
+    def profiles(self):
+        for p in self.gtx['people']:
+            self.render('profile.txt', p['_id'] + '.txt', p=p)
+        self.render('bio.txt', 'bio.txt')
+
+
+@pytest.mark.parametrize('materialize', [False, True])
+def test_tracked_rebuilds(tmpdir, capsys, materialize):
+    dbpath = tmpdir.mkdir('_dbs').mkdir('test').mkdir('db')
+    dbpath.join('people.yaml').write('alice:\n  name: Alice\n'
+                                     'bob:\n  name: Bob\n  bio: Hi\n')
+    rc = SimpleNamespace(builddir=str(tmpdir), cache=False, explain=True)
+    # materialized documents are only tracked by collection
+    bob = ALL if materialize else 'bob'
+
+    def build():
+        rc.client = FileSystemClient(rc)
+        rc.client.load_database({'name': 'test', 'path': 'db',
+                                 'blacklist': []})
+        rc.client.chained_db = ChainedCollections(rc.client, ['test'],
+                                                  materialize=materialize)
+        b = ProfilesBuilder(rc)
+        b.build()
+        return b
+
+    assert build().rendered == {'alice.txt', 'bob.txt', 'bio.txt'}
+    assert tmpdir.join('profiles', 'bio.txt').read() == 'Hi'
+    deps = build().manifest.get('profiles', 'bio.txt')['reads']
+    assert [read[:2] for read in deps] == [['people', bob]]
+    assert build().rendered == set()
+    assert 'bio.txt: up to date' in capsys.readouterr().out
+    # everything that lists the people depends on all of them
+    dbpath.join('people.yaml').write('alice:\n  name: Alice\n'
+                                     'bob:\n  name: Bob\n  bio: Bye\n')
+    assert build().rendered == {'alice.txt', 'bob.txt', 'bio.txt'}
+    assert tmpdir.join('profiles', 'bio.txt').read() == 'Bye'
+    changed = 'people' if materialize else 'people/bob'
+    assert 'profiles/bio.txt: {0} changed'.format(changed) in \
+        capsys.readouterr().out
+
+
+class NewsBuilder(PagesBuilder):
+    btype = 'news'
+
+    def __init__(self, rc):
+        super().__init__(rc, {}, {
+            'news.txt': '{{ rc.client.chained_db.news[key].body }}'})
+        self.cmds = ['news']
+
+    def news(self):
+        for key in list(self.rc.client.chained_db['news']):
+            self.render('news.txt', str(key) + '.txt', key=key)
+
+
+def test_non_string_ids(tmpdir, capsys):
+    # YAML keys such as these are loaded as an int and a date
+    dbpath = tmpdir.mkdir('_dbs').mkdir('test').mkdir('db')
+    dbpath.join('news.yaml').write('2019:\n  body: hi\n'
+                                   '2017-01-01:\n  body: yo\n')
+    rc = SimpleNamespace(builddir=str(tmpdir), cache=False, explain=True)
+
+    def build():
+        rc.client = FileSystemClient(rc)
+        rc.client.load_database({'name': 'test', 'path': 'db',
+                                 'blacklist': []})
+        rc.client.chained_db = ChainedCollections(rc.client, ['test'])
+        b = NewsBuilder(rc)
+        b.build()
+        return b
+
+    assert build().rendered == {'2019.txt', '2017-01-01.txt'}
+    assert {type(k) for k in rc.client.chained_db['news']} == \
+        {datetime.date, int}
+    assert build().rendered == set()
+    assert 'changed' not in capsys.readouterr().out
+    dbpath.join('news.yaml').write('2019:\n  body: bye\n'
+                                   '2017-01-01:\n  body: yo\n')
+    assert build().rendered == {'2019.txt'}
+    assert 'news/2019.txt: news/2019 changed' in capsys.readouterr().out
+
+
+def test_shared_env(tmpdir, monkeypatch):
+    # static files next to the user's templates are not compiled
+    monkeypatch.chdir(tmpdir)
+    static = tmpdir.mkdir('templates').mkdir('static')
+    static.join('site.js').write('{{ not a template')
+    static.join('logo.png').write_binary(b'\xff\xd8\xff')
+    tmpdir.join('templates', 'mine.html').write('{{ title }}')
+    rc = SimpleNamespace(builddir=str(tmpdir))
+    rc.jinja_env = make_env(rc)
+    precompile(rc.jinja_env)
+    cached = tmpdir.join('_jinja').listdir()
+    names = rc.jinja_env.list_templates()
+    assert 'static/site.js' in names and 'mine.html' in names
+    assert len(cached) == len(names) - 2
+    assert PeopleBuilder(rc).env is rc.jinja_env
+    # a later run loads the compiled templates rather than compiling them
+    env = make_env(rc)
+    env.compile = None
+    assert env.get_template('cv.tex') is not None
+    rc.cache = False
+    assert make_env(rc).bytecode_cache is None
+
+
+def test_render_many(tmpdir):
+    rc = SimpleNamespace(builddir=str(tmpdir))
+    b = PagesBuilder(rc, {}, {
+        'item.txt': '{{ static }} {{ title }}{% for i in range(n) %}!'
+                    '{% endfor %}{% set title = "x" %}'})
+    os.makedirs(os.path.join(b.bldir, 'items'))
+    items = [('top.txt', {'title': 'Top', 'n': 1})] + [
+        (os.path.join('items', str(i) + '.txt'), {'title': str(i), 'n': i})
+        for i in range(3)]
+    assert b.render_many('item.txt', items) == [f for f, _ in items]
+    assert tmpdir.join('pages', 'top.txt').read() == 'static Top!'
+    assert tmpdir.join('pages', 'items', '2.txt').read() == '../static 2!!'
+    assert b.render_many('item.txt', items[:2]) == []
+    b.gtx['title'] = 'Global'
+    b.force = True
+    assert b.render_many('item.txt', [('top.txt', {'n': 0})]) == ['top.txt']
+    assert tmpdir.join('pages', 'top.txt').read() == 'static Global'
+
+
+def test_write_stream(tmpdir):
+    fname = str(tmpdir.join('page.html'))
+    write_stream(iter(['<p>', 'hi', '</p>']), fname, bufsize=2)
+    assert tmpdir.join('page.html').read() == '<p>hi</p>'
+
+    def chunks():
+        yield '<p>'
+        raise ValueError('oops')
+    with pytest.raises(ValueError):
+        write_stream(chunks(), fname)
+    # the old file is left whole, and nothing else is left behind
+    assert tmpdir.join('page.html').read() == '<p>hi</p>'
+    assert tmpdir.listdir() == [tmpdir.join('page.html')]
+
+
+def test_render_streams(tmpdir):
+    rc = SimpleNamespace(builddir=str(tmpdir))
+    b = PagesBuilder(rc, {}, {'bad.txt': 'ok\n{{ 1 / n }}'})
+    os.makedirs(b.bldir)
+    assert b.render('bad.txt', 'bad.txt', n=1)
+    with pytest.raises(ZeroDivisionError):
+        b.render('bad.txt', 'bad.txt', n=0)
+    assert tmpdir.join('pages', 'bad.txt').read() == 'ok\n1.0'
+    assert len(tmpdir.join('pages').listdir()) == 1
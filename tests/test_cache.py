@@ -0,0 +1,36 @@
+import os
+
+from regolith.cache import CollectionCache
+
+
+def test_hit_and_invalidation(tmpdir):
+    cache = CollectionCache(str(tmpdir.join('_cache')))
+    f = tmpdir.join('people.yaml')
+    f.write('bob: {name: Bob}\n')
+    assert cache.get(str(f)) is None
+    cache.clear()
+    # the directory is only made once there is something to store
+    assert not tmpdir.join('_cache').exists()
+    cache.put(str(f), {'bob': {'name': 'Bob'}})
+    assert cache.get(str(f)) == {'bob': {'name': 'Bob'}}
+    # touching the file does not change its content
+    st = os.stat(str(f))
+    os.utime(str(f), ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert cache.get(str(f)) == {'bob': {'name': 'Bob'}}
+    f.write('bob: {name: Rob}\n')
+    assert cache.get(str(f)) is None
+
+
+def test_lru_eviction(tmpdir):
+    cache = CollectionCache(str(tmpdir.join('_cache')), maxsize=1)
+    big = 'x' * 2**19
+    files = []
+    for i in range(3):
+        f = tmpdir.join('coll{}.json'.format(i))
+        f.write(str(i))
+        files.append(str(f))
+        cache.put(files[-1], {str(i): {'_id': str(i), 'data': big}})
+        os.utime(cache._entry(files[-1])[1], (i, i))
+    cache.evict()
+    assert cache.get(files[0]) is None
+    assert cache.get(files[2]) is not None
@@ -1,4 +1,4 @@
-from regolith.chained_db import ChainDB
+from regolith.chained_db import ChainDB, CachingChainDB
 
 
 def test_dddi():
@@ -156,3 +156,48 @@ def test_dicts_in_lists_mutation():
     extend_list = z['a']['b']
     extend_list.extend([{'hi': 'world'}, {'spam': 'eggs'}])
     assert z['a']['b'] != extend_list
+
+
+def test_caching_merges_like_chaindb():
+    c = [{'m': 1}, {'n': 2}]
+    d = [{'o': 3}]
+    m1 = {'a': {'b': c, 'm': {'x': 0}, 'n': 'x'}}
+    m2 = {'a': {'b': d, 'm': {'y': 1}, 'n': 'y'}}
+    z = CachingChainDB(m1, m2)
+    assert isinstance(z['a'], ChainDB)
+    assert z['a']['m']['x'] == 0
+    assert z['a']['m']['y'] == 1
+    assert z['a']['n'] == 'y'
+    assert z['a']['b'] == c + d
+    # lists are not cached, so mutating one does not leak into the next
+    z['a']['b'].append({'hi': 'world'})
+    assert z['a']['b'] == c + d
+
+
+def test_caching_reuses_child_views():
+    m1 = {'a': {'m': {'x': 0}}}
+    m2 = {'a': {'m': {'y': 1}}}
+    z = CachingChainDB(m1, m2)
+    assert z['a'] is z['a']
+    assert z['a']['m'] is z['a']['m']
+    assert z['a']['m'].maps[1] is m2['a']['m']
+
+
+def test_caching_invalidation():
+    m1 = {'a': {'m': {'y': 0}}, 'b': 1}
+    m2 = {'a': {'m': {'y': 1}}}
+    z = CachingChainDB(m1)
+    a = z['a']
+    assert a['m']['y'] == 0
+    z.maps.append(m2)
+    assert z['a'] is not a
+    assert z['a']['m']['y'] == 1
+    z['a']['m']['y'] = 2
+    assert z['a']['m']['y'] == 2
+    assert z['b'] == 1
+    z['b'] = 3
+    assert z['b'] == 3
+    del z['b']
+    assert z['b'] is None
+    z.maps[1] = {'a': {'m': 'flat'}}
+    assert z['a']['m'] == 'flat'
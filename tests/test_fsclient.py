@@ -0,0 +1,216 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from regolith import fsclient
+from regolith.database import ChainedCollections
+from regolith.fsclient import FileSystemClient, dump_json, load_collection, \
+    load_json
+
+YAML_PEOPLE = """\
+bob:
+  name: Bob  # the builder
+  aka:
+    - Bobby
+alice:
+  name: Alice
+"""
+
+
+@pytest.fixture
+def dbdir(tmpdir):
+    dbpath = tmpdir.mkdir('_dbs').mkdir('test').mkdir('db')
+    dbpath.join('people.yaml').write(YAML_PEOPLE)
+    dump_json(str(dbpath.join('grades.json')),
+              {str(i): {'_id': str(i), 'student': 's' + str(i % 3),
+                        'scores': [i, 2 * i]} for i in range(10)})
+    return tmpdir
+
+
+def make_client(dbdir, **kwargs):
+    rc = SimpleNamespace(builddir=str(dbdir), **kwargs)
+    db = {'name': 'test', 'url': 'git@example', 'path': 'db',
+          'blacklist': []}
+    client = FileSystemClient(rc)
+    client.load_database(db)
+    return client, db
+
+
+def test_parallel_load_matches_serial(dbdir):
+    serial, db = make_client(dbdir, nprocs=1, cache=False)
+    parallel, _ = make_client(dbdir, nprocs=2, cache=False)
+    parallel.load_collections(['people', 'grades'])
+    assert parallel.dbs['test'].pending() == {}
+    assert serial.dbs['test'] == parallel.dbs['test']
+    assert parallel._collfiletypes == {'people': 'yaml', 'grades': 'json'}
+    # dumping must not depend on how the collections were loaded
+    people = dbdir.join('_dbs', 'test', 'db', 'people.yaml')
+    serial.dump_database(db)
+    expected = people.read()
+    parallel.dump_database(db)
+    assert people.read() == expected
+
+
+def test_on_demand_load_during_prefetch(dbdir, monkeypatch):
+    dbpath = dbdir.join('_dbs', 'test', 'db')
+    dump_json(str(dbpath.join('news.json')), {'n': {'_id': 'n'}})
+    release = threading.Event()
+
+    def slow_load(f, filetype):
+        if not f.endswith('people.yaml'):
+            release.wait(10)
+        return load_collection(f, filetype)
+
+    # threads rather than processes, so that the parsing can be held up
+    monkeypatch.setattr(fsclient, 'ProcessPoolExecutor', ThreadPoolExecutor)
+    monkeypatch.setattr(fsclient, 'load_collection', slow_load)
+    client, _ = make_client(dbdir, nprocs=2, cache=False)
+    db = client.dbs['test']
+    client.prefetch(['grades', 'news'])
+    # parsed on demand, without waiting for the prefetched collections
+    assert db['people']['bob']['name'] == 'Bob'
+    assert set(db.pending()) == {'grades', 'news'}
+    release.set()
+    client.wait()
+    assert db.pending() == {}
+    assert db['news'] == {'n': {'_id': 'n'}}
+
+
+def test_load_from_cache(dbdir):
+    first, _ = make_client(dbdir)
+    first.load_collections(['people', 'grades'])
+    assert len(dbdir.join('_cache').listdir()) == 2
+    second, _ = make_client(dbdir, nprocs=2)
+    second.load_collections(['people', 'grades'])
+    assert first.dbs['test'] == second.dbs['test']
+
+
+def test_lazy_loading(dbdir):
+    client, _ = make_client(dbdir, cache=False)
+    db = client.dbs['test']
+    assert set(db) == {'people', 'grades'}
+    assert db.loaded() == {}
+    client.chained_db = ChainedCollections(client, ['test'])
+    assert client.all_documents('people')
+    assert set(db.loaded()) == {'people'}
+    client.prefetch(['grades'])
+    client.wait()
+    assert db.pending() == {}
+    assert list(client.all_documents('nothing')) == []
+
+
+@pytest.mark.parametrize('materialize', [False, True])
+def test_chained_collections(dbdir, materialize):
+    client, _ = make_client(dbdir, cache=False)
+    upstream = dbdir.join('_dbs').mkdir('up').mkdir('db')
+    upstream.join('people.yaml').write('bob:\n  name: Robert\n  age: 42\n')
+    client.load_database({'name': 'up', 'url': 'git@example', 'path': 'db',
+                          'blacklist': []})
+    client.chained_db = ChainedCollections(client, ['test', 'up'],
+                                           materialize=materialize)
+    people = client.chained_db['people']
+    assert isinstance(people['bob'], dict) is materialize
+    assert people['bob']['name'] == 'Bob'
+    assert people['bob']['age'] == 42
+    if materialize:
+        assert people['alice'] is client.dbs['test']['people']['alice']
+    # writes through the client show up in the merged documents
+    client.update_one('test', 'people', {'_id': 'bob'}, {'age': 7})
+    client.insert_one('up', 'people', {'_id': 'eve', 'name': 'Eve'})
+    client.delete_one('test', 'people', {'_id': 'alice'})
+    assert people['bob']['age'] == 7
+    assert people['eve']['name'] == 'Eve'
+    assert 'alice' not in people
+
+
+def test_only_dirty_collections_are_dumped(dbdir):
+    client, db = make_client(dbdir, cache=False)
+    client.load_collections(['people', 'grades'])
+    assert client.dump_database(db) == []
+    client.update_one('test', 'grades', {'_id': '3'}, {'student': 'x'})
+    assert client.dirty_documents('test', 'grades') == {'3'}
+    assert client.dump_database(db) == ['db/grades.json']
+    assert client.dirty_documents('test', 'grades') is None
+    assert client.dump_database(db) == []
+
+
+def test_json_streaming_roundtrip(tmpdir):
+    docs = {str(i): {'_id': str(i), 'b': [1.5, None], 'a': 'é' * i}
+            for i in range(25)}
+    f = tmpdir.join('coll.json')
+    dump_json(str(f), docs)
+    expected = '\n'.join(json.dumps(docs[k], sort_keys=True)
+                         for k in sorted(docs))
+    assert f.read_text('utf-8') == expected
+    assert load_json(str(f), batchsize=7) == docs
+    f.write_text(expected + '\n\n', 'utf-8')
+    assert load_json(str(f)) == docs
+
+
+def test_indexed_find_and_update(dbdir):
+    client, _ = make_client(dbdir, cache=False,
+                            indexes={'grades': ['student']})
+    assert client.find_one('test', 'grades', {'_id': '4'})['student'] == 's1'
+    assert client.find_one('test', 'grades', {'student': 's2'})['_id'] == '2'
+    index = client.get_index('test', 'grades', 'student')
+    assert index.get('s0') == ['0', '3', '6', '9']
+    client.update_one('test', 'grades', {'_id': '3'}, {'student': 's9'})
+    assert index.get('s0') == ['0', '6', '9']
+    assert client.find_one('test', 'grades', {'student': 's9'})['_id'] == '3'
+    client.delete_one('test', 'grades', {'_id': '0'})
+    assert client.find_one('test', 'grades', {'student': 's0'})['_id'] == '6'
+    assert client.get_index('test', 'grades', 'scores') is None
+
+
+def test_find(dbdir):
+    client, _ = make_client(dbdir, cache=False,
+                            indexes={'grades': ['student']})
+    client.chained_db = ChainedCollections(client, ['test'])
+    ids = [doc['_id'] for doc in client.find(
+        'test', 'grades', {'student': {'$in': ['s0', 's2']}})]
+    assert sorted(ids) == ['0', '2', '3', '5', '6', '8', '9']
+    cursor = client.find(None, 'grades', {'scores': {'$gte': 16}},
+                         projection={'student': 1}, sort=[('_id', -1)])
+    assert list(cursor) == [{'_id': '9', 'student': 's0'},
+                            {'_id': '8', 'student': 's2'}]
+    cursor = client.find(None, 'grades').sort('_id').limit(2)
+    assert [doc['_id'] for doc in cursor] == ['0', '1']
+    # null matches the documents that lack an indexed key
+    client.insert_one('test', 'grades', {'_id': '10', 'scores': []})
+    ids = [doc['_id'] for doc in client.find('test', 'grades',
+                                             {'student': None})]
+    assert ids == ['10']
+
+
+def test_people_index(dbdir):
+    citations = dbdir.join('_dbs', 'test', 'db').join('citations.yaml')
+    citations.write('paper1:\n  author: [Bob, Alice]\n'
+                    'paper2:\n  author: [Bobby]\n'
+                    'paper3:\n  author: [Eve]\n')
+    client, _ = make_client(dbdir, cache=False)
+    client.chained_db = ChainedCollections(client, ['test'])
+    # the builders' by-name lookups are indexed by default
+    index = client.get_index('test', 'citations', 'author')
+    assert index.get('Bob') == ['paper1']
+    found = client.find(None, 'citations', {'author': {'$in': ['Bob',
+                                                               'Bobby']}})
+    assert [doc['_id'] for doc in found] == ['paper1', 'paper2']
+    assert client.get_index('test', 'projects', 'team.name') is not None
+
+
+def test_bulk_upsert(dbdir):
+    client, _ = make_client(dbdir, cache=False,
+                            indexes={'grades': ['student']})
+    client.get_index('test', 'grades', 'student')
+    client.bulk_upsert('test', 'grades', [
+        {'_id': '1', 'student': 'new'},
+        {'_id': '42', 'student': 'new', 'scores': []},
+        ])
+    assert client.find_one('test', 'grades', {'_id': '1'}) == {
+        '_id': '1', 'student': 'new', 'scores': [1, 2]}
+    assert client.get_index('test', 'grades', 'student').get('new') == \
+        ['1', '42']
+    assert client.dirty_documents('test', 'grades') == {'1', '42'}
@@ -0,0 +1,190 @@
+import numpy as np
+import pytest
+
+import scipy.stats as st
+
+from regolith.gradebook import DEFAULT_LETTER_SCALE, Gradebook, \
+    grade_stats, letter_grades, letter_indices
+from regolith.gradebuilder import find_letter_grade
+
+COURSE = {'_id': 'C', 'students': ['a', 'b', 'c'],
+          'weights': {'hw': 0.4, 'exam': 0.6}}
+
+ASSIGNMENTS = [
+    {'_id': 'hw2', 'category': 'hw', 'courses': ['C'], 'points': [2, 2],
+     'questions': ['1', '2']},
+    {'_id': 'exam', 'category': 'exam', 'courses': ['C', 'D'],
+     'points': [10], 'questions': ['1']},
+    {'_id': 'hw1', 'category': 'hw', 'courses': ['C'], 'points': [1, 2, 3],
+     'questions': ['1', '2', '3']},
+    {'_id': 'other', 'category': 'hw', 'courses': ['D'], 'points': [5],
+     'questions': ['1']},
+    ]
+
+GRADES = [
+    {'student': 'a', 'course': 'C', 'assignment': 'hw1', 'scores': [1, 2, 3]},
+    {'student': 'a', 'course': 'C', 'assignment': 'hw2', 'scores': [2, 2]},
+    {'student': 'a', 'course': 'C', 'assignment': 'exam', 'scores': [8]},
+    {'student': 'a', 'course': 'C', 'assignment': 'exam', 'scores': [0]},
+    {'student': 'b', 'course': 'C', 'assignment': 'hw1', 'scores': [1, 1, 1]},
+    {'student': 'b', 'course': 'C', 'assignment': 'exam', 'scores': [5]},
+    {'student': 'b', 'course': 'D', 'assignment': 'hw2', 'scores': [2, 2]},
+    {'student': 'x', 'course': 'C', 'assignment': 'hw1', 'scores': [1, 1, 1]},
+    ]
+
+
+@pytest.fixture
+def book():
+    return Gradebook(COURSE, ASSIGNMENTS, GRADES)
+
+
+def test_load(book):
+    assert [a['_id'] for a in book.assignments] == ['exam', 'hw1', 'hw2']
+    assert book.categories == ['exam', 'hw']
+    assert book.points.tolist() == [[10, 0, 0], [1, 2, 3], [2, 2, 0]]
+    assert book.scores.shape == (3, 3, 3)
+    assert book.graded.tolist() == [[True, True, True],
+                                    [True, True, False],
+                                    [False, False, False]]
+    # the first of duplicate grades is used
+    assert book.scores[0, 0, 0] == 8
+    grades = book.student_grades(1)
+    assert grades['exam'][0]['scores'] == [5]
+    assert grades['hw'][0]['scores'] == [1, 1, 1] and grades['hw'][1] is None
+    grouped = book.grouped_assignments()
+    assert [a['_id'] for a in grouped['hw']] == ['hw1', 'hw2']
+
+
+def test_totals(book):
+    assert book.category_max().tolist() == [10, 10]
+    assert book.category_totals().tolist() == [[8, 10], [5, 3], [0, 0]]
+    wavgs = book.weighted_averages()
+    assert np.allclose(wavgs, [0.88, 0.42, 0.0])
+    assert book.student_totals(1) == [['exam', 5, 10, 0.6, 0.3],
+                                      ['hw', 3, 10, 0.4, 0.12]]
+    curve = book.curve(wavgs)
+    assert np.isclose(curve, 0.12)
+    letters = book.letter_grades(wavgs, curve)
+    assert letters.raw == ['B+', 'F', 'F']
+    assert letters.curved == ['A+', 'F', 'F']
+
+
+def test_integer_totals():
+    rows = Gradebook(COURSE, ASSIGNMENTS, GRADES).student_totals(0)
+    assert [type(x) for x in rows[0][1:3]] == [int, int]
+    grades = GRADES + [{'student': 'c', 'course': 'C', 'assignment': 'hw2',
+                        'scores': [1.5, 2]}]
+    rows = Gradebook(COURSE, ASSIGNMENTS, grades).student_totals(2)
+    assert [type(x) for x in rows[1][1:3]] == [float, int]
+    assert rows[1][1] == 3.5
+
+
+def test_integer_weights():
+    course = dict(COURSE, weights={'hw': 40, 'exam': 60})
+    book = Gradebook(course, ASSIGNMENTS, GRADES)
+    rows = book.student_totals(1)
+    assert rows == [['exam', 5, 10, 60, 30.0], ['hw', 3, 10, 40, 12.0]]
+    assert [type(row[3]) for row in rows] == [int, int]
+    assert np.allclose(book.weighted_averages(), [0.88, 0.42, 0.0])
+
+
+def test_letter_indices():
+    scores = [1.5, 0.97, 0.9699, 0.6, 0.1, -3.0]
+    letters = [DEFAULT_LETTER_SCALE[i][1] for i in letter_indices(scores)]
+    assert letters == ['A+', 'A+', 'A', 'D-', 'F', 'F']
+    scale = [[0.5, 'P'], [0.9, 'H'], [-1.0, 'F']]
+    assert [scale[i][1] for i in letter_indices([0.95, 0.7, 0.2], scale)] \
+        == ['H', 'P', 'F']
+
+
+def test_letter_grades():
+    scale = [[0.875, 'A'], [0.75, 'B'], [0.5, 'D'], [-1.0, 'F']]
+    raw = np.array([0.9, 0.8, 0.76, 0.3])
+    grades = letter_grades(raw, raw + 0.1, scale)
+    assert grades.letters == ['F', 'D', 'B', 'A']
+    assert grades.raw == ['A', 'B', 'B', 'F']
+    assert grades.curved == ['A', 'A', 'B', 'F']
+    assert grades.raw_counts.tolist() == [1, 0, 2, 1]
+    assert grades.curved_counts.tolist() == [1, 0, 1, 2]
+    empty = letter_grades([], [])
+    assert empty.raw == [] and empty.raw_counts.sum() == 0
+    assert len(empty.letters) == len(DEFAULT_LETTER_SCALE)
+
+
+def test_find_letter_grade():
+    for score in np.linspace(-0.5, 1.5, 201):
+        expected = next((letter for lower, letter in DEFAULT_LETTER_SCALE
+                         if lower <= score), 'F')
+        assert find_letter_grade(score) == expected
+    assert find_letter_grade(float('nan')) == 'F'
+
+
+def test_nan_scores():
+    indices = letter_indices([np.nan, 0.9])
+    assert [DEFAULT_LETTER_SCALE[i][1] for i in indices] == ['F', 'A-']
+    grades = letter_grades([np.nan], [np.inf])
+    assert grades.raw == grades.curved == ['F']
+
+
+def test_empty_course():
+    book = Gradebook({'_id': 'E', 'students': ['a'], 'weights': {}},
+                     ASSIGNMENTS, GRADES)
+    assert book.category_totals().shape == (1, 0)
+    assert book.student_totals(0) == []
+    with pytest.raises(ValueError, match="'E'"):
+        book.weighted_averages()
+
+
+def test_zero_point_category():
+    assignments = ASSIGNMENTS + [{'_id': 'quiz', 'category': 'quiz',
+                                  'courses': ['C'], 'points': [0],
+                                  'questions': ['1']}]
+    course = dict(COURSE, weights={'hw': 0.4, 'exam': 0.5, 'quiz': 0.1})
+    book = Gradebook(course, assignments, GRADES)
+    with pytest.raises(ValueError, match="'C'.*quiz"):
+        book.weighted_fractions()
+    with pytest.raises(ValueError):
+        book.weighted_averages()
+
+
+def reference_stats(data):
+    mu = np.mean(data, axis=0)
+    sig = np.std(data, axis=0)
+    max_score = np.max(data, axis=0)
+    norm = st.norm(mu, sig)
+    total = np.sum(data, axis=1)
+    total_norm = st.norm(np.mean(total), np.std(total))
+    return (mu, sig, max_score, 1.0 - norm.cdf(0.6 * max_score),
+            1.0 - norm.cdf(0.8 * max_score), np.mean(total), np.std(total),
+            np.max(total), 1.0 - total_norm.cdf(0.6 * np.max(total)),
+            1.0 - total_norm.cdf(0.8 * np.max(total)))
+
+
+def test_grade_stats():
+    rng = np.random.RandomState(42)
+    grades = []
+    for course, nq in [('C', 3), ('D', 2)]:
+        for asgn, n in [('hw1', nq), ('hw2', nq + 2)]:
+            for student in range(5):
+                grades.append({'course': course, 'assignment': asgn,
+                               'student': student,
+                               'scores': rng.randint(0, 10, n).tolist()})
+    rng.shuffle(grades)
+    grades.append({'assignment': 'hw1', 'scores': [100, 100, 100]})
+    stats = grade_stats(grades)
+    assert set(stats) == {'C', 'D'}
+    for course, cstats in stats.items():
+        assert set(cstats) == {'hw1', 'hw2'}
+        for asgn, astats in cstats.items():
+            data = [g['scores'] for g in grades
+                    if g.get('course') == course and g['assignment'] == asgn]
+            for x, y in zip(astats, reference_stats(data)):
+                assert np.shape(x) == np.shape(y)
+                assert np.allclose(x, y)
+    assert grade_stats([]) == {}
+    # maxima are integers when the scores are
+    assert stats['C']['hw1'][2].dtype.kind == 'i'
+    assert isinstance(stats['C']['hw1'][7].item(), int)
+    floats = grade_stats([{'course': 'C', 'assignment': 'a',
+                           'scores': [1.5, 2]}])
+    assert floats['C']['a'][2].tolist() == [1.5, 2.0]
@@ -0,0 +1,197 @@
+import os
+import subprocess
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from regolith import latex
+from regolith.database import ChainedCollections
+from regolith.fsclient import FileSystemClient, dump_json
+from regolith.gradebook import Gradebook
+from regolith.gradebuilder import GradeReportBuilder
+
+from test_gradebook import ASSIGNMENTS, COURSE, GRADES
+
+
+@pytest.fixture
+def rc(tmpdir):
+    dbpath = tmpdir.mkdir('_dbs').mkdir('test').mkdir('db')
+    for collname, docs in [('courses', [COURSE]),
+                           ('assignments', ASSIGNMENTS),
+                           ('grades', GRADES)]:
+        docs = {doc.get('_id', str(i)): dict(doc, _id=doc.get('_id', str(i)))
+                for i, doc in enumerate(docs)}
+        dump_json(str(dbpath.join(collname + '.json')), docs)
+    rc = SimpleNamespace(builddir=str(tmpdir), cache=False)
+    rc.client = FileSystemClient(rc)
+    rc.client.load_database({'name': 'test', 'path': 'db', 'blacklist': []})
+    rc.client.chained_db = ChainedCollections(rc.client, ['test'])
+    return rc
+
+
+def test_latex(rc, tmpdir):
+    b = GradeReportBuilder(rc)
+    os.makedirs(b.bldir)
+    b.latex()
+    assert b.bases == ['a-C', 'b-C', 'c-C']
+    report = tmpdir.join('grades', 'b-C.tex').read()
+    assert 'Total weighted average, raw:} 42.0\\%' in report
+    assert 'Letter Grade, curved:} F' in report
+    assert '\\textbf{ hw }\n\n    & 3\n\n    & 10\n' in report
+    report = tmpdir.join('grades', 'a-C.tex').read()
+    assert 'Letter Grade, curved:} A+' in report
+    # the std and max of the exam, and of its total
+    assert report.count('    3.3 &\n    8 &\n') == 2
+
+
+def test_makestats(rc):
+    b = GradeReportBuilder(rc)
+    stats = b.makestats(COURSE)
+    assert set(stats) == {'hw1', 'hw2', 'exam', 'other'}
+    assert stats['other'] == ((0,), (0,), (0,), (0,), (0,), 0, 0, 0, 0, 0)
+    assert np.allclose(stats['hw1'][0], [1, 4 / 3, 5 / 3])
+    assert stats['exam'][7] == 8
+    # all of the courses are computed at once
+    assert set(b._stats) == {'C', 'D'}
+
+
+def fake_run(bldir, calls):
+    def run(cmd):
+        calls.append(cmd[0])
+        if cmd[0] == 'latex':
+            tex = open(os.path.join(bldir, cmd[-1])).read()
+            n = tex.count('\\clearpage')
+            marks = ['\\regolithpage{{{0}}}{{{1}}}'.format(i, 2 * i + 1)
+                     for i in range(n)]
+            marks.append('\\regolithpage{{end}}{{{0}}}'.format(2 * n + 1))
+            with open(os.path.join(bldir, cmd[-1][:-4] + '.aux'), 'w') as f:
+                f.write('\n'.join(marks) + '\n')
+        elif cmd[0] in ('dvipdf', 'gs'):
+            out = cmd[-1] + '.pdf' if cmd[0] == 'dvipdf' else \
+                cmd[-2][len('-sOutputFile='):]
+            open(os.path.join(bldir, out), 'w').close()
+        return subprocess.CompletedProcess(cmd, 0, '')
+    return run
+
+
+def no_plot(self, letters, course_id):
+    return None
+
+
+def test_batch(rc, tmpdir, monkeypatch):
+    monkeypatch.setattr(latex, 'PdfReader', None)
+    monkeypatch.setattr(GradeReportBuilder, 'plot_letter_grades', no_plot)
+    b = GradeReportBuilder(rc)
+    os.makedirs(b.bldir)
+    b.latex()
+    tmpdir.join('grades', 'a-C.tex').write('stale')
+    rc.batch_grades = True
+    b = GradeReportBuilder(rc)
+    calls = []
+    b.run = fake_run(b.bldir, calls)
+    b.build()
+    assert b.bases == ['C']
+    assert b.reports == {'C': ['a-C', 'b-C', 'c-C']}
+    report = tmpdir.join('grades', 'C.tex').read()
+    assert report.count('\\documentclass') == 1
+    assert report.count('\\reporttitle{ C Grades }') == 3
+    assert '\\regolithpagemark{2}' in report
+    assert calls == ['latex', 'dvipdf', 'gs', 'gs', 'gs']
+    assert sorted(f.basename for f in tmpdir.join('grades').listdir()) == \
+        ['C.aux', 'C.pdf', 'C.tex', 'a-C.pdf', 'b-C.pdf', 'c-C.pdf']
+    # nothing changed, but a report went missing
+    tmpdir.join('grades', 'b-C.pdf').remove()
+    b = GradeReportBuilder(rc)
+    calls = []
+    b.run = fake_run(b.bldir, calls)
+    b.build()
+    assert calls == ['gs', 'gs', 'gs']
+    assert tmpdir.join('grades', 'b-C.pdf').isfile()
+    # back to a report at a time
+    rc.batch_grades = False
+    b = GradeReportBuilder(rc)
+    b.run = fake_run(b.bldir, [])
+    b.build()
+    assert sorted(f.basename for f in tmpdir.join('grades').listdir()) == \
+        ['a-C.pdf', 'a-C.tex', 'b-C.pdf', 'b-C.tex', 'c-C.pdf', 'c-C.tex']
+
+
+def test_batch_student_left(rc, tmpdir, monkeypatch):
+    monkeypatch.setattr(latex, 'PdfReader', None)
+    monkeypatch.setattr(GradeReportBuilder, 'plot_letter_grades', no_plot)
+    rc.batch_grades = True
+    b = GradeReportBuilder(rc)
+    b.run = fake_run(b.bldir, [])
+    b.build()
+    assert tmpdir.join('grades', 'c-C.pdf').isfile()
+    rc.client.update_one('test', 'courses', {'_id': 'C'},
+                         {'students': ['a', 'b']})
+    b = GradeReportBuilder(rc)
+    b.run = fake_run(b.bldir, [])
+    b.build()
+    assert sorted(f.basename for f in tmpdir.join('grades').listdir()) == \
+        ['C.aux', 'C.pdf', 'C.tex', 'a-C.pdf', 'b-C.pdf']
+    assert 'c-C.pdf' not in b.manifest.files('grades')
+
+
+def fake_plot(self, letters, course_id):
+    name = course_id + '-letter-grade-dist'
+    with open(os.path.join(self.bldir, name + '.eps'), 'w') as f:
+        f.write(repr(letters.raw_counts.tolist()))
+    return name
+
+
+def test_letter_plot_per_course(rc, tmpdir, monkeypatch):
+    monkeypatch.setattr(GradeReportBuilder, 'plot_letter_grades', fake_plot)
+    rc.client.insert_one('test', 'courses',
+                         {'_id': 'D', 'students': ['b', 'd'],
+                          'weights': {'hw': 0.5, 'exam': 0.5}})
+    rc.batch_grades = True
+    b = GradeReportBuilder(rc)
+    b.run = fake_run(b.bldir, [])
+    b.build()
+    assert b.bases == ['C', 'D']
+    for course_id in ['C', 'D']:
+        report = tmpdir.join('grades', course_id + '.tex').read()
+        assert report.count('{' + course_id + '-letter-grade-dist.eps}') == \
+            len(b.reports[course_id])
+        assert 'letter-grade-dist' not in report.replace(
+            course_id + '-letter-grade-dist', '')
+    b = GradeReportBuilder(rc)
+    b.run = fake_run(b.bldir, [])
+    b.build()
+    assert b.rendered == set()
+    # the reports are made again when only the plot changes
+    letter_grades = Gradebook.letter_grades
+
+    def more_raw_counts(book, wavgs, curve):
+        letters = letter_grades(book, wavgs, curve)
+        return letters._replace(raw_counts=letters.raw_counts + 1)
+
+    monkeypatch.setattr(Gradebook, 'letter_grades', more_raw_counts)
+    b = GradeReportBuilder(rc)
+    b.run = fake_run(b.bldir, [])
+    b.build()
+    assert b.rendered == {'C.tex', 'D.tex'}
+    assert ['_files', 'D-letter-grade-dist.eps'] == \
+        b.manifest.get('grades', 'D.tex')['reads'][0][:2]
+
+
+def test_letter_plot_unchanged(rc, tmpdir, monkeypatch):
+    pytest.importorskip('matplotlib')
+    monkeypatch.delenv('SOURCE_DATE_EPOCH', raising=False)
+    monkeypatch.setattr(time, 'ctime', lambda: 'Then')
+    rc.batch_grades = True
+    b = GradeReportBuilder(rc)
+    b.run = fake_run(b.bldir, [])
+    b.build()
+    assert b'%%CreationDate: Then' in \
+        tmpdir.join('grades', 'C-letter-grade-dist.eps').read_binary()
+    # plotted again at another time
+    monkeypatch.setattr(time, 'ctime', lambda: 'Now')
+    b = GradeReportBuilder(rc)
+    b.run = fake_run(b.bldir, [])
+    b.build()
+    assert b.rendered == set()
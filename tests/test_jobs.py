@@ -0,0 +1,48 @@
+import sys
+import subprocess
+
+from regolith.jobs import run_job, run_jobs
+
+
+def run(cmd):
+    return subprocess.run(cmd, check=True, stdout=subprocess.PIPE,
+                          stderr=subprocess.STDOUT, universal_newlines=True)
+
+
+def py(code):
+    return [sys.executable, '-c', code]
+
+
+def test_run_job_stops_at_failure():
+    ok, output = run_job([py('print("a")'), py('import sys; sys.exit(3)'),
+                          py('print("c")')], run)
+    assert not ok
+    assert output.startswith('a\n')
+    assert 'c\n' not in output
+
+
+def test_run_job_callable_steps():
+    def step(run):
+        run(py('print("x")'))
+        run(py('print("y")'))
+    assert run_job([step], run) == (True, 'x\ny\n')
+
+
+def test_run_job_failing_callable_step():
+    def step(run):
+        run(py('print("x")'))
+        raise ValueError('no pages')
+    ok, output = run_job([step, py('print("y")')], run)
+    assert not ok
+    assert output == 'x\nno pages\n'
+
+
+def test_run_jobs(tmpdir, capsys):
+    jobs = {str(i): [py('import time; time.sleep(0.1)'),
+                     py('open({0!r}, "w").close()'.format(
+                         str(tmpdir.join(str(i)))))]
+            for i in range(4)}
+    jobs['bad'] = [['regolith-no-such-command']]
+    assert run_jobs(jobs, run, nprocs=4) == ['bad']
+    assert sorted(f.basename for f in tmpdir.listdir()) == ['0', '1', '2', '3']
+    assert 'bad failed' in capsys.readouterr().err
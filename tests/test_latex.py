@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+from regolith import latex
+from regolith.latex import compile_latex, page_marks, split_pdf
+
+CITING = '\\citation{a}\n\\bibstyle{plain}\n\\bibdata{refs}\n'
+
+
+def fake_tools(builddir, body):
+    """Returns a run function that mimics latex and bibtex, and the list of
+    the tools that it ran.
+    """
+    calls = []
+
+    def run(cmd):
+        calls.append(cmd[0])
+        aux = os.path.join(builddir, 'doc.aux')
+        bbl = os.path.join(builddir, 'doc.bbl')
+        if cmd[0] == 'latex':
+            content = '\\relax\n' + body
+            if os.path.exists(bbl):
+                content += '\\bibcite{a}{1}\n'
+            with open(aux, 'w') as f:
+                f.write(content)
+        elif cmd[0] == 'bibtex':
+            with open(bbl, 'w') as f:
+                f.write('\\begin{thebibliography}{1}\n')
+    return run, calls
+
+
+def test_no_bibliography(tmpdir):
+    run, calls = fake_tools(str(tmpdir), '')
+    compile_latex('doc', str(tmpdir))(run)
+    assert calls == ['latex']
+
+
+def test_bibliography(tmpdir):
+    tmpdir.join('refs.bib').write('@article{a, title={A}}')
+    run, calls = fake_tools(str(tmpdir), CITING)
+    step = compile_latex('doc', str(tmpdir))
+    step(run)
+    assert calls == ['latex', 'bibtex', 'latex', 'latex']
+    # nothing changed, so a single pass suffices
+    del calls[:]
+    step(run)
+    assert calls == ['latex']
+    # the bibliography changed, so bibtex runs again
+    tmpdir.join('refs.bib').write('@article{a, title={B}}')
+    del calls[:]
+    step(run)
+    assert calls == ['latex', 'bibtex', 'latex']
+
+
+def test_page_marks(tmpdir):
+    tmpdir.join('doc.aux').write('\\relax\n\\regolithpage{0}{1}\n'
+                                 '\\regolithpage{1}{3}\n'
+                                 '\\regolithpage{end}{4}\n')
+    assert page_marks(str(tmpdir.join('doc.aux'))) == {'0': 1, '1': 3,
+                                                        'end': 4}
+    assert page_marks(str(tmpdir.join('missing.aux'))) == {}
+
+
+def test_split_pdf_with_gs(tmpdir, monkeypatch):
+    monkeypatch.setattr(latex, 'PdfReader', None)
+    tmpdir.join('doc.aux').write('\\regolithpage{0}{1}\n'
+                                 '\\regolithpage{1}{3}\n'
+                                 '\\regolithpage{end}{4}\n')
+    calls = []
+    split_pdf('doc', str(tmpdir), ['a', 'b'])(calls.append)
+    assert [c[0] for c in calls] == ['gs', 'gs']
+    assert calls[0][-4:] == ['-dFirstPage=1', '-dLastPage=2',
+                             '-sOutputFile=a.pdf', 'doc.pdf']
+    assert calls[1][-4:] == ['-dFirstPage=3', '-dLastPage=3',
+                             '-sOutputFile=b.pdf', 'doc.pdf']
+    with pytest.raises(ValueError):
+        split_pdf('doc', str(tmpdir), ['a', 'b', 'c'])(calls.append)
@@ -0,0 +1,48 @@
+from types import SimpleNamespace
+
+from regolith.mongoclient import MongoClient, upsert_update
+
+
+class FakeCollection(list):
+
+    def find(self, filter=None, projection=None):
+        return iter(self)
+
+
+def make_client(dbs):
+    # no server is needed for what happens client side
+    client = MongoClient.__new__(MongoClient)
+    client.client = {name: {'people': FakeCollection(docs)}
+                     for name, docs in dbs.items()}
+    client.chained_db = SimpleNamespace(dbnames=list(dbs))
+    return client
+
+
+def test_find_all_databases_merges_by_id():
+    client = make_client({
+        'first': [{'_id': 'bob', 'name': 'Bob', 'bio': 'Hi'}],
+        'second': [{'_id': 'bob', 'name': 'Robert', 'title': 'Dr.'},
+                   {'_id': 'alice', 'name': 'Alice'}],
+        })
+    docs = list(client.find(None, 'people', sort='_id'))
+    assert docs == [{'_id': 'alice', 'name': 'Alice'},
+                    {'_id': 'bob', 'name': 'Bob', 'bio': 'Hi',
+                     'title': 'Dr.'}]
+    # the filter sees the merged documents
+    assert [doc['_id'] for doc in client.find(
+        None, 'people', {'name': 'Bob', 'title': 'Dr.'})] == ['bob']
+    assert list(client.find(None, 'people', {'name': 'Robert'})) == []
+
+
+def test_upsert_update():
+    assert upsert_update({'_id': 'bob', 'name': 'Bob'}) == \
+        {'$set': {'name': 'Bob'}}
+    # an empty $set is rejected by the server
+    assert upsert_update({'_id': 'bob'}) == {'$setOnInsert': {'_id': 'bob'}}
+
+
+def test_prefetch_is_a_no_op():
+    # connect() prefetches on every backend
+    client = make_client({'first': []})
+    client.prefetch(['people'])
+    client.wait()
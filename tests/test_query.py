@@ -0,0 +1,74 @@
+import datetime
+
+import pytest
+
+from regolith.query import Cursor, field_values, match, project, sort_docs
+
+DOC = {'_id': 'p', 'year': 2016, 'author': ['a', 'b'],
+       'team': [{'name': 'x'}, {'name': 'y', 'sub': {'name': 'z'}}]}
+
+
+def test_field_values():
+    assert list(field_values(DOC, 'author')) == ['a', 'b']
+    assert list(field_values(DOC, 'team.name')) == ['x', 'y']
+    assert list(field_values(DOC, 'team.sub.name')) == ['z']
+    assert list(field_values(DOC, 'missing')) == []
+
+
+@pytest.mark.parametrize('filter, exp', [
+    ({}, True),
+    ({'_id': 'p'}, True),
+    ({'_id': 'q'}, False),
+    ({'author': 'b'}, True),
+    ({'author': ['a', 'b']}, True),
+    ({'team.name': 'y'}, True),
+    ({'team.name': {'$in': ['q', 'x']}}, True),
+    ({'team.name': {'$nin': ['q', 'x']}}, False),
+    ({'author': {'$ne': 'c'}}, True),
+    ({'year': {'$gt': 2015, '$lte': 2016}}, True),
+    ({'year': {'$lt': 2016}}, False),
+    ({'year': {'$gt': 'text'}}, False),
+    ({'missing': {'$exists': False}}, True),
+    ({'team.sub': {'$exists': True}}, True),
+    ({'missing': None}, True),
+    ({'missing': {'$eq': None}}, True),
+    ({'missing': {'$in': [None, 1]}}, True),
+    ({'missing': {'$ne': None}}, False),
+    ({'year': None}, False),
+    ({'year': {'$ne': None}}, True),
+    ])
+def test_match(filter, exp):
+    assert match(DOC, filter) is exp
+
+
+def test_match_unknown_operator():
+    with pytest.raises(ValueError):
+        match(DOC, {'year': {'$regex': '20'}})
+
+
+def test_project():
+    assert project(DOC, None) is DOC
+    assert project(DOC, {'year': 1}) == {'_id': 'p', 'year': 2016}
+    assert project(DOC, {'year': 1, '_id': 0}) == {'year': 2016}
+    assert set(project(DOC, {'team': 0, 'author': 0})) == {'_id', 'year'}
+
+
+def test_sort_and_cursor():
+    docs = [{'_id': 1, 'k': 'b'}, {'_id': 2}, {'_id': 3, 'k': 'a'},
+            {'_id': 4, 'k': 'a'}]
+    assert [d['_id'] for d in sort_docs(docs, 'k')] == [2, 3, 4, 1]
+    assert [d['_id'] for d in sort_docs(docs, [('k', 1), ('_id', -1)])] == \
+        [2, 4, 3, 1]
+    cursor = Cursor(docs, {'k': {'$exists': True}}, projection={'_id': 1})
+    assert list(cursor.sort('_id', -1).limit(2)) == [{'_id': 4}, {'_id': 3}]
+
+
+def test_sort_mixed_types():
+    docs = [{'_id': 1, 'k': 'a'}, {'_id': 2, 'k': 3}, {'_id': 3},
+            {'_id': 4, 'k': None}, {'_id': 5, 'k': True},
+            {'_id': 6, 'k': 1.5}, {'_id': 7, 'k': datetime.date(2020, 1, 1)},
+            {'_id': 8, 'k': datetime.datetime(2019, 1, 1)},
+            {'_id': 9, 'k': {'a': 1}}, {'_id': 10, 'k': {'a': 'b'}}]
+    assert [d['_id'] for d in sort_docs(docs, 'k')] == \
+        [3, 4, 6, 2, 1, 9, 10, 5, 8, 7]
+    assert [d['_id'] for d in sort_docs(docs, [('k', -1)])][-2:] == [3, 4]
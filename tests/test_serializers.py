@@ -0,0 +1,56 @@
+import importlib
+import json
+import sys
+import types
+
+import pytest
+
+from regolith import serializers
+
+
+@pytest.fixture(params=serializers.BACKENDS)
+def backend(request):
+    old = serializers.BACKEND
+    serializers.set_backend(request.param)
+    yield request.param
+    serializers.set_backend(old)
+
+
+@pytest.mark.parametrize('s', [
+    '{"_id": "a", "x": [1, 2.5, null, true], "y": "\\u00e9"}',
+    '{"_id": "c", "nan": NaN}',
+    ])
+def test_loads(backend, s):
+    assert json.dumps(serializers.loads(s)) == json.dumps(json.loads(s))
+
+
+def test_default_backend():
+    assert serializers.BACKEND == serializers.BACKENDS[0]
+
+
+def test_default_backend_is_fast(monkeypatch):
+    fake = types.ModuleType('ujson')
+    fake.loads = json.loads
+    monkeypatch.setitem(sys.modules, 'ujson', fake)
+    try:
+        importlib.reload(serializers)
+        assert serializers.BACKEND in ('orjson', 'ujson')
+        assert serializers.BACKENDS[-1] == 'json'
+    finally:
+        monkeypatch.undo()
+        importlib.reload(serializers)
+
+
+@pytest.mark.parametrize('big', ['123456789012345678901234567890',
+                                 '-9223372036854775809',
+                                 '18446744073709551616'])
+def test_backends_keep_big_integers(backend, big):
+    s = '{"_id": "a", "big": ' + big + ', "small": 1}'
+    doc = serializers.loads(s)
+    assert doc['big'] == int(big)
+    assert serializers.dumps(doc) == s
+
+
+def test_dumps_matches_stdlib():
+    doc = {'z': 1, 'a': {'é': [0.1, 1e-05]}, '_id': 'x'}
+    assert serializers.dumps(doc) == json.dumps(doc, sort_keys=True)
@@ -0,0 +1,24 @@
+from regolith.tools import filter_publications, overlay_doc
+
+
+def test_overlay_doc():
+    doc = {'_id': 'x', 'author': ['a'], 'title': 'T'}
+    view = overlay_doc(doc, author=['b'])
+    assert view['author'] == ['b']
+    assert view['title'] == 'T'
+    view['title'] = 'U'
+    assert view['title'] == 'U'
+    assert doc == {'_id': 'x', 'author': ['a'], 'title': 'T'}
+
+
+def test_filter_publications_shares_citations():
+    cites = [{'_id': 'p1', 'author': ['Bob', 'Eve'], 'year': 2016},
+             {'_id': 'p2', 'author': ['Eve'], 'year': 2017},
+             {'_id': 'p3', 'author': ['Bobby'], 'year': 2015}]
+    names = frozenset(['Bob', 'Bobby'])
+    pubs = filter_publications(cites, names, reverse=True)
+    assert [pub['_id'] for pub in pubs] == ['p1', 'p3']
+    assert pubs[0]['author'] == ['\\textbf{Bob}', 'Eve']
+    assert cites[0]['author'] == ['Bob', 'Eve']
+    pubs = filter_publications(cites, names, bold=False)
+    assert pubs[1] is cites[0]
@@ -0,0 +1,28 @@
+from regolith.tracking import ALL, TrackedDocument, TrackedList, graph, \
+    record, track
+
+
+def test_track():
+    record('people', 'nobody')
+    with track() as reads:
+        record('people', 'bob')
+        with track() as inner:
+            record('news')
+        record('people', 'alice')
+    assert reads == {('people', 'bob'), ('people', 'alice')}
+    assert inner == {('news', ALL)}
+    assert graph(reads | inner) == {'people': ['alice', 'bob'],
+                                    'news': [ALL]}
+
+
+def test_tracked_containers():
+    doc = TrackedDocument({'name': 'Bob'}, {'name': 'Robert', 'age': 4})
+    doc.collname, doc.docid = 'people', 'bob'
+    docs = TrackedList('people', [doc])
+    assert doc['name'] == 'Bob'
+    with track() as reads:
+        assert doc.get('honors') is None
+    assert reads == {('people', 'bob')}
+    with track() as reads:
+        assert [d['age'] for d in docs] == [4]
+    assert reads == {('people', 'bob'), ('people', ALL)}